@@ -0,0 +1,74 @@
+import sys
+import time
+import statistics
+import subprocess
+from pathlib import Path
+
+# CONFIGURATION
+ROOT_DIR = Path(__file__).resolve().parent.parent
+CLI = ROOT_DIR / "src" / "ecovaluate.py"
+
+BUDGET_MS = 200  # Median cold start allowed for lightweight commands
+N_RUNS = 10
+
+LIGHTWEIGHT_COMMANDS = [
+    ["--help"],
+    ["config"],
+    ["registry", "list"],
+]
+
+# None of these may be imported by a lightweight command
+HEAVY_MODULES = ["polars", "numpy", "pandas", "catboost", "sklearn", "shap", "matplotlib", "scipy"]
+
+
+def imported_heavy_modules(command: list) -> list:
+    """Runs the command with -X importtime and returns any heavy top-level modules it loaded."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", str(CLI), *command],
+        capture_output=True, text=True
+    )
+    loaded = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        module = line.rsplit("|", 1)[-1].strip().split(".")[0]
+        loaded.add(module)
+    return [module for module in HEAVY_MODULES if module in loaded]
+
+
+def median_startup_ms(command: list) -> float:
+    timings = []
+    for _ in range(N_RUNS):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, str(CLI), *command], capture_output=True, check=True)
+        timings.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(timings)
+
+
+def run_startup_benchmark() -> bool:
+    print(f"CLI STARTUP BENCHMARK (budget: {BUDGET_MS} ms median over {N_RUNS} runs)")
+    print("-" * 60)
+
+    passed = True
+    for command in LIGHTWEIGHT_COMMANDS:
+        label = " ".join(command)
+        elapsed = median_startup_ms(command)
+        heavy = imported_heavy_modules(command)
+
+        status = "OK"
+        if elapsed > BUDGET_MS:
+            status = "TOO SLOW"
+            passed = False
+        if heavy:
+            status = f"HEAVY IMPORTS: {heavy}"
+            passed = False
+
+        print(f"{label:<20} {elapsed:8.1f} ms   {status}")
+
+    print("-" * 60)
+    print("STATUS: STARTUP WITHIN BUDGET." if passed else "STATUS: STARTUP REGRESSION DETECTED.")
+    return passed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_startup_benchmark() else 1)
@@ -0,0 +1,103 @@
+import sys
+import time
+import tempfile
+import statistics
+import numpy as np
+import polars as pl
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+import config as cfg
+from catboost import CatBoostRegressor
+from sklearn.metrics import r2_score
+from feature_engineering import ENCODED_COLS, compute_target_encodings, apply_target_encodings
+from train_model import MODEL_PARAMS
+
+# CONFIGURATION
+INPUT_FILE = cfg.MODEL_READY_FILE
+BENCH_ITERATIONS = 300  # Fixed tree count so both variants do the same boosting work
+N_SINGLE_ROW_CALLS = 200
+
+BASE_FEATURES = ["TOTAL_FLOOR_AREA", "energy_rating_rank", "transaction_year", "property_type", "old_new", "town"]
+VARIANTS = {
+    "raw district": BASE_FEATURES + ["postcode_district"],
+    "target encoded": BASE_FEATURES + ENCODED_COLS,
+}
+
+
+def to_matrix(df: pl.DataFrame, feature_cols: list):
+    X = df.select(feature_cols).to_pandas()
+    return X, np.where(X.dtypes == object)[0]
+
+
+def benchmark_variant(name: str, df_train: pl.DataFrame, df_test: pl.DataFrame, lookups: dict) -> dict:
+    feature_cols = VARIANTS[name]
+    X_train, cat_features_indices = to_matrix(df_train, feature_cols)
+    X_test, _ = to_matrix(df_test, feature_cols)
+
+    params = {**MODEL_PARAMS, "iterations": BENCH_ITERATIONS}
+    model = CatBoostRegressor(**params, verbose=0)
+
+    t0 = time.perf_counter()
+    model.fit(X_train, df_train["price"].to_numpy(), cat_features=cat_features_indices)
+    train_seconds = time.perf_counter() - t0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_file = Path(tmp) / "model.cbm"
+        model.save_model(str(model_file))
+        model_mb = model_file.stat().st_size / 1024 ** 2
+
+    t0 = time.perf_counter()
+    predictions = model.predict(X_test)
+    batch_us_per_row = (time.perf_counter() - t0) / len(X_test) * 1e6
+
+    # Single-row latency from a raw model-ready row, including the lookup join when encoded
+    raw_rows = df_test.drop([col for col in ENCODED_COLS if col in df_test.columns])
+    timings = []
+    for i in range(min(N_SINGLE_ROW_CALLS, raw_rows.height)):
+        row = raw_rows.slice(i, 1)
+        t0 = time.perf_counter()
+        if name == "target encoded":
+            row = apply_target_encodings(row, lookups)
+        model.predict(to_matrix(row, feature_cols)[0])
+        timings.append((time.perf_counter() - t0) * 1000)
+
+    return {
+        "variant": name,
+        "train_s": train_seconds,
+        "model_mb": model_mb,
+        "batch_us_per_row": batch_us_per_row,
+        "single_row_ms_p50": statistics.median(timings),
+        "r2": r2_score(df_test["price"].to_numpy(), predictions),
+    }
+
+
+def run_encoding_benchmark():
+    print("TARGET ENCODING BENCHMARK")
+    print("-" * 60)
+
+    if not INPUT_FILE.exists():
+        print(f"CRITICAL ERROR: {INPUT_FILE} not found!")
+        return
+
+    df = pl.read_parquet(INPUT_FILE).with_columns(
+        pl.col("postcode").str.split(" ").list.first().alias("postcode_district")
+    )
+    df = df.sample(fraction=1.0, shuffle=True, seed=cfg.RANDOM_SEED)
+    n_test = int(df.height * cfg.TEST_SIZE)
+    df_test, df_train = df.head(n_test), df.tail(df.height - n_test)
+
+    # Encodings are fitted on the training split only, as in production
+    df_train, lookups = compute_target_encodings(df_train)
+    df_test = apply_target_encodings(df_test, lookups)
+
+    print(f"Train rows: {df_train.height:,} | Test rows: {df_test.height:,} | "
+          f"Districts: {df_train['postcode_district'].n_unique():,}")
+
+    results = [benchmark_variant(name, df_train, df_test, lookups) for name in VARIANTS]
+
+    with pl.Config(float_precision=3):
+        print(pl.DataFrame(results))
+
+
+if __name__ == "__main__":
+    run_encoding_benchmark()
@@ -0,0 +1,219 @@
+import os
+import sys
+import multiprocessing
+import numpy as np
+import polars as pl
+import config as cfg
+import profiling
+from concurrent.futures import ProcessPoolExecutor
+from catboost import CatBoostRegressor, Pool
+from sklearn.metrics import r2_score, mean_absolute_error, mean_squared_error
+from pathlib import Path
+from train_model import prepare_features, MODEL_PARAMS, FEATURE_SPEC_VERSION, FEATURE_COLS
+from feature_engineering import (
+    compute_target_encodings, apply_target_encodings, ENCODED_COLS, FOLD_COLUMNS, N_FOLDS, SMOOTHING
+)
+
+sys.path.append(str(Path(__file__).parent))
+
+INPUT_FILE = cfg.MODEL_READY_FILE
+REPORT_FILE = cfg.BACKTEST_REPORT_FILE
+CACHE_DIR = cfg.BACKTEST_CACHE_DIR
+
+# BACKTEST SETTINGS
+PERIOD = "quarter"  # "year" or "quarter"
+SCHEME = "expanding"  # "expanding" (all history) or "rolling" (last ROLLING_WINDOW periods)
+ROLLING_WINDOW = 8  # Training periods per fold in rolling mode
+MIN_TRAIN_PERIODS = 4  # First fold needs at least this much history
+N_WORKERS = 4  # Folds trained concurrently
+
+# Columns a fold reads: model features (the district is derived from the postcode and
+# the encodings are refitted per fold), the target and the encoding inputs
+FOLD_INPUT_COLS = sorted(
+    {col for col in FEATURE_COLS if col not in ENCODED_COLS and col != "postcode_district"}
+    | {"postcode", "price", "price_per_sqm", "transaction_year", "transaction_quarter"}
+    | set(FOLD_COLUMNS)
+)
+
+
+def add_period_index(df: pl.DataFrame) -> pl.DataFrame:
+    """Adds a monotonically increasing 'period' integer and a readable label."""
+    if PERIOD == "year":
+        return df.with_columns([
+            pl.col("transaction_year").alias("period"),
+            pl.col("transaction_year").cast(pl.Utf8).alias("period_label")
+        ])
+    return df.with_columns([
+        (pl.col("transaction_year") * 4 + pl.col("transaction_quarter") - 1).alias("period"),
+        pl.format("{}-Q{}", "transaction_year", "transaction_quarter").alias("period_label")
+    ])
+
+
+def build_folds(periods: list) -> list:
+    """
+    Walk-forward folds: each fold trains on periods strictly before the test
+    period, so no future price ever reaches the training set.
+    """
+    folds = []
+    for i in range(MIN_TRAIN_PERIODS, len(periods)):
+        if SCHEME == "rolling":
+            train_periods = periods[max(0, i - ROLLING_WINDOW):i]
+        else:
+            train_periods = periods[:i]
+        folds.append((train_periods[0], train_periods[-1], periods[i]))
+    return folds
+
+
+def data_fingerprint() -> str:
+    """Cheap fingerprint of the input file, used to invalidate cached pools."""
+    stat = INPUT_FILE.stat()
+    return f"{stat.st_size}_{int(stat.st_mtime)}"
+
+
+def period_year(period: int) -> int:
+    return period if PERIOD == "year" else period // 4
+
+
+def load_fold_data(first_period: int, last_period: int) -> pl.DataFrame:
+    """
+    Reads only the columns and periods one fold needs. The year filter is pushed
+    into the parquet scan, so a worker never holds the whole model-ready file.
+    """
+    return (
+        pl.scan_parquet(INPUT_FILE)
+        .select(FOLD_INPUT_COLS)
+        .filter(pl.col("transaction_year").is_between(period_year(first_period), period_year(last_period)))
+        .pipe(add_period_index)
+        .filter(pl.col("period").is_between(first_period, last_period))
+        .collect()
+    )
+
+
+def load_train_pool(df_train: pl.DataFrame, train_start: int, train_end: int) -> Pool:
+    """
+    Returns the quantized training pool for a window, building and caching it on
+    first use. Quantization (feature borders + categorical hashing) is the bulk of
+    CatBoost's preprocessing, so reruns and repeated windows skip it entirely.
+    The key includes the feature-spec version and encoding parameters, so a
+    change to the feature layout never reuses a stale pool.
+    """
+    encoding_tag = f"te{N_FOLDS}s{SMOOTHING}" if cfg.USE_TARGET_ENCODING else "raw"
+    cache_file = CACHE_DIR / (
+        f"{cfg.CITY_SLUG}_{PERIOD}_{train_start}_{train_end}_fs{FEATURE_SPEC_VERSION}_{encoding_tag}"
+        f"_{data_fingerprint()}.bin"
+    )
+
+    if cache_file.exists():
+        return Pool(f"quantized://{cache_file}")
+
+    X_train, cat_features_indices = prepare_features(df_train)
+    pool = Pool(X_train, df_train["price"].to_numpy(), cat_features=cat_features_indices)
+    pool.quantize()
+    # Write-then-rename so a killed worker never leaves a truncated pool for later runs
+    tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+    pool.save(str(tmp_file))
+    os.replace(tmp_file, cache_file)
+    return pool
+
+
+def run_fold(fold: tuple) -> dict:
+    train_start, train_end, test_period = fold
+
+    df = load_fold_data(train_start, test_period)
+    df_train = df.filter(pl.col("period").is_between(train_start, train_end))
+    df_test = df.filter(pl.col("period") == test_period)
+
+    # Encodings are re-fitted on the training window only, so the test period
+    # (and anything after it) never feeds the location statistics
+    if cfg.USE_TARGET_ENCODING:
+        df_train, lookups = compute_target_encodings(df_train)
+        df_test = apply_target_encodings(df_test, lookups)
+
+    train_pool = load_train_pool(df_train, train_start, train_end)
+    X_test, _ = prepare_features(df_test)
+    y_test = df_test["price"].to_numpy()
+
+    # No early stopping: the test period must stay unseen during training
+    model = CatBoostRegressor(
+        **MODEL_PARAMS,
+        thread_count=max(1, os.cpu_count() // N_WORKERS),
+        verbose=0
+    )
+    model.fit(train_pool)
+    predictions = model.predict(X_test)
+
+    return {
+        "period": test_period,
+        "period_label": df_test["period_label"][0],
+        "n_train": train_pool.num_row(),
+        "n_test": len(y_test),
+        "r2": r2_score(y_test, predictions),
+        "mae": mean_absolute_error(y_test, predictions),
+        "rmse": float(np.sqrt(mean_squared_error(y_test, predictions)))
+    }
+
+
+@profiling.profiled("backtest")
+def run_backtest():
+    """
+    Time-based walk-forward evaluation of the valuation model.
+
+    Unlike the shuffled split in train_model, every fold is scored on a period
+    that lies entirely after its training window, which measures how the
+    model ages when used for forward valuations.
+    """
+    print(f"Starting {SCHEME} backtest by {PERIOD}...")
+
+    if not INPUT_FILE.exists():
+        print(f" Input file not found: {INPUT_FILE}")
+        return
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+    periods = (
+        add_period_index(pl.scan_parquet(INPUT_FILE).select(["transaction_year", "transaction_quarter"]))
+        .select(pl.col("period").unique().sort())
+        .collect()["period"]
+        .to_list()
+    )
+    folds = build_folds(periods)
+
+    if not folds:
+        print(f"Not enough history for a backtest ({len(periods)} periods, need > {MIN_TRAIN_PERIODS}).")
+        return
+
+    threads_per_worker = max(1, os.cpu_count() // N_WORKERS)
+    print(f"Running {len(folds)} folds on {N_WORKERS} workers ({threads_per_worker} threads each)...")
+
+    # Spawn (not fork) so each worker gets a clean Polars/CatBoost thread pool.
+    # Spawned workers read POLARS_MAX_THREADS from the inherited environment when they import Polars.
+    user_threads = os.environ.get("POLARS_MAX_THREADS")
+    os.environ["POLARS_MAX_THREADS"] = str(threads_per_worker)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=N_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            results = list(pool.map(run_fold, folds))
+    finally:
+        if user_threads is None:
+            os.environ.pop("POLARS_MAX_THREADS", None)
+        else:
+            os.environ["POLARS_MAX_THREADS"] = user_threads
+
+    report = pl.DataFrame(results).sort("period").drop("period")
+
+    print("\n--- BACKTEST RESULTS ---")
+    with pl.Config(tbl_rows=100, float_precision=4):
+        print(report)
+
+    print(f"\nMean R2: {report['r2'].mean():.4f} | "
+          f"Mean MAE: GBP {report['mae'].mean():,.0f} | "
+          f"Mean RMSE: GBP {report['rmse'].mean():,.0f}")
+
+    report.write_csv(REPORT_FILE)
+    print(f"Backtest report saved to: {REPORT_FILE}")
+
+
+if __name__ == "__main__":
+    run_backtest()
@@ -0,0 +1,144 @@
+import os
+import sys
+import tempfile
+import multiprocessing
+import numpy as np
+import polars as pl
+import config as cfg
+import profiling
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from train_model import prepare_registered_features
+from model_registry import ModelCache, list_versions
+
+sys.path.append(str(Path(__file__).parent))
+
+CITIES = cfg.COMPARISON_CITIES
+REPORT_FILE = cfg.COMPARISON_REPORT_FILE
+
+# BOOTSTRAP SETTINGS
+N_BOOTSTRAP = 2000  # Resamples per city
+BATCH_SIZE = 16  # Resamples drawn together as one (BATCH_SIZE, n) index array
+CI_LEVEL = 0.95
+BASELINE_RANK = 4  # Premiums are measured against a 'D' rating
+
+RATING_LABELS = {7: "A", 6: "B", 5: "C", 4: "D", 3: "E", 2: "F", 1: "G"}
+
+
+def counterfactual_premiums(city: str) -> np.ndarray:
+    """
+    Predicts every property at each EPC band while holding its other features fixed.
+    Returns an (n, 7) matrix of premiums in GBP versus the baseline band, so
+    column r-1 is the model's price change from moving a home from 'D' to rank r.
+    """
+    # Each city's active registry version; features and encodings follow its registry entry
+    model, lookups, model_info = ModelCache().load(city)
+
+    df = pl.read_parquet(cfg.city_paths(city)["MODEL_READY_FILE"])
+    X, _ = prepare_registered_features(df, model_info, lookups)
+
+    predictions = np.empty((len(X), len(RATING_LABELS)), dtype=np.float64)
+    for rank in RATING_LABELS:
+        X["energy_rating_rank"] = rank
+        predictions[:, rank - 1] = model.predict(X)
+
+    return predictions - predictions[:, [BASELINE_RANK - 1]]
+
+
+def bootstrap_means(task: tuple) -> np.ndarray:
+    """
+    Draws n_resamples bootstrap means of the premium matrix (homes are resampled;
+    the model that produced the premiums is not refitted).
+
+    The matrix is memory-mapped from disk, so every worker shares the same pages.
+    Each batch of resamples is one (BATCH_SIZE, n) index array; its row-wise
+    counts turn the resampled means into a single matrix product.
+    """
+    premiums_path, seed, n_resamples = task
+    premiums = np.load(premiums_path, mmap_mode="r")
+    n = premiums.shape[0]
+    rng = np.random.default_rng(seed)
+
+    means = []
+    for start in range(0, n_resamples, BATCH_SIZE):
+        b = min(BATCH_SIZE, n_resamples - start)
+        idx = rng.integers(0, n, size=(b, n))
+        flat = (idx + np.arange(b)[:, None] * n).ravel()
+        counts = np.bincount(flat, minlength=b * n).reshape(b, n)
+        means.append(counts @ premiums / n)
+
+    return np.vstack(means)
+
+
+def city_premium_table(city: str, pool: ProcessPoolExecutor, workdir: Path) -> pl.DataFrame:
+    print(f"[{city}] Computing counterfactual predictions per EPC band...")
+    premiums = counterfactual_premiums(city)
+    premiums_path = workdir / f"premiums_{cfg.city_slug(city)}.npy"
+    np.save(premiums_path, premiums)
+
+    # Split the resamples into one task per worker, each with an independent seed stream
+    n_tasks = min(N_BOOTSTRAP, os.cpu_count())
+    sizes = np.diff(np.linspace(0, N_BOOTSTRAP, n_tasks + 1).astype(int))
+    seeds = np.random.SeedSequence(cfg.RANDOM_SEED).spawn(n_tasks)
+
+    print(f"[{city}] Running {N_BOOTSTRAP:,} bootstrap resamples over {premiums.shape[0]:,} sales...")
+    tasks = [(str(premiums_path), seed, int(size)) for seed, size in zip(seeds, sizes)]
+    draws = np.vstack(list(pool.map(bootstrap_means, tasks)))
+
+    alpha = (1 - CI_LEVEL) / 2
+    low, high = np.quantile(draws, [alpha, 1 - alpha], axis=0)
+    point = premiums.mean(axis=0)
+
+    ranks = sorted(RATING_LABELS, reverse=True)
+    return pl.DataFrame({
+        "rating": [RATING_LABELS[r] for r in ranks],
+        f"{cfg.city_slug(city)}_premium": [point[r - 1] for r in ranks],
+        f"{cfg.city_slug(city)}_ci_low": [low[r - 1] for r in ranks],
+        f"{cfg.city_slug(city)}_ci_high": [high[r - 1] for r in ranks],
+    })
+
+
+@profiling.profiled("compare")
+def compare_green_premiums():
+    """
+    Side-by-side Green Premium report with bootstrap intervals.
+
+    For each city, the trained model values every home at each EPC band; the
+    average change versus a 'D' rating is the rating premium. The bootstrap
+    resamples homes under that one fixed model, so each interval shows how much
+    the average premium depends on which homes are in the sample. It does not
+    include the model's own estimation uncertainty (retraining on other data
+    could move every band), so intervals that do not overlap are not by
+    themselves a significance test of the difference between cities.
+    """
+    print(f"Starting Green Premium comparison for: {', '.join(CITIES)}")
+
+    for city in CITIES:
+        input_file = cfg.city_paths(city)["MODEL_READY_FILE"]
+        if not input_file.exists() or not list_versions(city):
+            print(f"Required inputs not found for {city}.\n"
+                  f"Input: {input_file}\nRegistered models: {len(list_versions(city))}")
+            return
+
+    tables = []
+    # Spawn (not fork): the parent already runs Polars and CatBoost thread pools
+    spawn = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp, ProcessPoolExecutor(mp_context=spawn) as pool:
+        for city in CITIES:
+            tables.append(city_premium_table(city, pool, Path(tmp)))
+
+    report = tables[0]
+    for table in tables[1:]:
+        report = report.join(table, on="rating", how="left")
+
+    print(f"\n--- GREEN PREMIUM vs 'D' RATING (GBP, {CI_LEVEL:.0%} home-resampling interval, model held fixed) ---")
+    with pl.Config(tbl_cols=-1, float_precision=0):
+        print(report)
+
+    REPORT_FILE.parent.mkdir(exist_ok=True)
+    report.write_csv(REPORT_FILE)
+    print(f"Comparison report saved to: {REPORT_FILE}")
+
+
+if __name__ == "__main__":
+    compare_green_premiums()
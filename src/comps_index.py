@@ -0,0 +1,177 @@
+import sys
+import time
+import numpy as np
+import polars as pl
+import config as cfg
+import profiling
+from datetime import date
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+INPUT_FILE = cfg.MODEL_READY_FILE
+INDEX_FILE = cfg.COMPS_INDEX_FILE
+
+# Land Registry property type codes (Detached, Semi, Terraced, Flat, Other)
+PROPERTY_TYPE_CODES = {"D": 0, "S": 1, "T": 2, "F": 3, "O": 4}
+
+# Similarity weights: a 10% floor area difference costs about as much as one EPC band
+AREA_SCALE = 0.1
+RATING_SCALE = 1.0
+
+INDEX_COLUMNS = [
+    "postcode_district", "district_id", "date", "TOTAL_FLOOR_AREA",
+    "property_type", "property_type_code", "energy_rating_rank",
+    "CURRENT_ENERGY_RATING", "price", "postcode", "paon", "saon", "street"
+]
+
+
+@profiling.profiled("comps_index")
+def build_comps_index():
+    """
+    Writes a compact, memory-mappable Arrow file for comparable-sales lookups.
+
+    Rows are sorted by district, then date, then floor area, so each district is
+    a contiguous block and date filters become binary searches inside it.
+    The file is written uncompressed so it can be memory-mapped at load time.
+    """
+    print("Building comparable-sales index...")
+
+    if not INPUT_FILE.exists():
+        print(f"CRITICAL ERROR: {INPUT_FILE} not found. Please run feature engineering first.")
+        return
+
+    try:
+        df = profiling.collect(
+            pl.scan_parquet(INPUT_FILE)
+            .with_columns(
+                pl.col("postcode").str.split(" ").list.first().alias("postcode_district"),
+                pl.col("date").cast(pl.Date),
+                pl.col("TOTAL_FLOOR_AREA").cast(pl.Float32),
+                pl.col("energy_rating_rank").cast(pl.Int8),
+                pl.col("property_type").replace_strict(
+                    PROPERTY_TYPE_CODES, default=PROPERTY_TYPE_CODES["O"], return_dtype=pl.UInt8
+                ).alias("property_type_code")
+            )
+            .sort(["postcode_district", "date", "TOTAL_FLOOR_AREA"])
+            # Dense district ids follow the sort order, so each id is one contiguous block
+            .with_columns(
+                pl.col("postcode_district").rank("dense").cast(pl.UInt32).alias("district_id")
+            )
+            .select(INDEX_COLUMNS),
+            "comps_index"
+        )
+
+        df.write_ipc(INDEX_FILE, compression="uncompressed")
+        print(f"Indexed {df.height:,} sales across {df['district_id'].n_unique():,} districts.")
+        print(f"Index saved to: {INDEX_FILE}")
+
+    except Exception as e:
+        print(f"Error building comps index: {e}")
+
+
+class ComparablesIndex:
+    """
+    In-memory comparable-sales index over a memory-mapped Arrow file.
+
+    Numeric columns are exposed as zero-copy NumPy views, and district
+    boundaries are resolved once at load time. A query only touches the
+    rows of a single district.
+    """
+
+    def __init__(self, path: Path = INDEX_FILE):
+        self._df = pl.read_ipc(path, memory_map=True)
+
+        self._area = self._df["TOTAL_FLOOR_AREA"].to_numpy()
+        self._rating = self._df["energy_rating_rank"].to_numpy()
+        self._ptype = self._df["property_type_code"].to_numpy()
+        self._days = self._df["date"].to_physical().to_numpy()
+
+        # District block boundaries: [starts[i], ends[i]) for each district
+        district_id = self._df["district_id"].to_numpy()
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(district_id)) + 1])
+        ends = np.append(starts[1:], len(district_id))
+        names = self._df["postcode_district"].gather(starts).to_list()
+        self._blocks = dict(zip(names, zip(starts.tolist(), ends.tolist())))
+
+    def __len__(self) -> int:
+        return self._df.height
+
+    @property
+    def districts(self) -> list:
+        return list(self._blocks)
+
+    def query(
+        self,
+        district: str,
+        floor_area: float,
+        property_type: str,
+        energy_rating_rank: int,
+        k: int = 10,
+        min_rating: int = None,
+        max_rating: int = None,
+        date_from: date = None,
+        date_to: date = None,
+    ) -> pl.DataFrame:
+        """
+        Returns the k most similar sales in the same district and property type,
+        ranked by log floor-area distance plus EPC rank distance.
+        """
+        if district not in self._blocks:
+            return self._df.clear().with_columns(pl.lit(None, pl.Float64).alias("comp_distance"))
+
+        start, end = self._blocks[district]
+
+        # Date filters narrow the block with binary search (rows are date-sorted per district)
+        if date_from is not None:
+            start += int(np.searchsorted(self._days[start:end], _to_days(date_from), side="left"))
+        if date_to is not None:
+            end = start + int(np.searchsorted(self._days[start:end], _to_days(date_to), side="right"))
+
+        mask = self._ptype[start:end] == PROPERTY_TYPE_CODES.get(property_type, PROPERTY_TYPE_CODES["O"])
+        if min_rating is not None:
+            mask &= self._rating[start:end] >= min_rating
+        if max_rating is not None:
+            mask &= self._rating[start:end] <= max_rating
+
+        candidates = np.flatnonzero(mask) + start
+        if len(candidates) == 0:
+            return self._df.clear().with_columns(pl.lit(None, pl.Float64).alias("comp_distance"))
+
+        score = (
+            np.abs(np.log(self._area[candidates] / floor_area)) / AREA_SCALE
+            + np.abs(self._rating[candidates] - energy_rating_rank) / RATING_SCALE
+        )
+
+        if len(candidates) > k:
+            top = np.argpartition(score, k)[:k]
+        else:
+            top = np.arange(len(candidates))
+        top = top[np.argsort(score[top], kind="stable")]
+
+        return self._df[candidates[top]].with_columns(pl.Series("comp_distance", score[top]))
+
+
+def _to_days(value: date) -> int:
+    return (value - date(1970, 1, 1)).days
+
+
+if __name__ == "__main__":
+    build_comps_index()
+
+    if INDEX_FILE.exists():
+        index = ComparablesIndex()
+        sample = index._df.row(len(index) // 2, named=True)
+
+        t0 = time.perf_counter()
+        comps = index.query(
+            sample["postcode_district"],
+            sample["TOTAL_FLOOR_AREA"],
+            sample["property_type"],
+            sample["energy_rating_rank"],
+        )
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+
+        print(f"\nComparables for a {sample['TOTAL_FLOOR_AREA']:.0f} sqm sale in {sample['postcode_district']}:")
+        print(comps.select(["date", "postcode", "TOTAL_FLOOR_AREA", "CURRENT_ENERGY_RATING", "price", "comp_distance"]))
+        print(f"Query time: {elapsed_ms:.3f} ms")
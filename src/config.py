@@ -1,8 +1,12 @@
+import os
+import re
 from pathlib import Path
 
 # CONTROL PANEL
-# "LONDON" or "LEEDS"
-CURRENT_CITY = "LONDON"
+# "LONDON", "LEEDS" or any other Price Paid town name (see prepare_comparison_city).
+# Can be overridden per run with the ECOVALUATE_CITY environment variable
+# (the ecovaluate CLI sets it from --city).
+CURRENT_CITY = os.environ.get("ECOVALUATE_CITY", "LONDON").upper()
 
 ROOT_DIR = Path(__file__).resolve().parent.parent
 
@@ -11,26 +15,68 @@ ROOT_DIR = Path(__file__).resolve().parent.parent
 DATA_DIR = ROOT_DIR / "data"
 MODEL_DIR = ROOT_DIR / "models"
 FIGURES_DIR = ROOT_DIR / "figures"
+PROFILE_DIR = ROOT_DIR / "profiles"  # Opt-in stage profiles (see profiling.py)
 
-MODEL_DIR.mkdir(exist_ok=True)
-FIGURES_DIR.mkdir(exist_ok=True)
-
-if CURRENT_CITY == "LEEDS":
-    RAW_PRICE_FILE = DATA_DIR / "price_paid_leeds.parquet"
-    RAW_EPC_FILE = DATA_DIR / "epc_leeds.parquet"
-    MERGED_FILE = DATA_DIR / "merged_leeds.parquet"
-    MODEL_READY_FILE = DATA_DIR / "final_model_ready_leeds.parquet"
-    MODEL_PATH = MODEL_DIR / "catboost_leeds_model.cbm"
-    FIGURE_PATH_CURVE = FIGURES_DIR / "green_premium_curve_leeds.png"
-    FIGURE_PATH_SUMMARY = FIGURES_DIR / "shap_summary_leeds.png"
-else:
-    RAW_PRICE_FILE = DATA_DIR / "price_paid_london.parquet"
-    RAW_EPC_FILE = DATA_DIR / "epc_london.parquet"
-    MERGED_FILE = DATA_DIR / "merged_london.parquet"
-    MODEL_READY_FILE = DATA_DIR / "final_model_ready_london.parquet"
-    MODEL_PATH = MODEL_DIR / "catboost_london_model.cbm"
-    FIGURE_PATH_CURVE = FIGURES_DIR / "green_premium_curve_london.png"
-    FIGURE_PATH_SUMMARY = FIGURES_DIR / "shap_summary_london.png"
+# Postcode -> coordinates lookup (e.g. an ONS NSPL extract), shared by all cities.
+# Expected columns: 'postcode', 'lat', 'long'.
+POSTCODE_LOOKUP_FILE = DATA_DIR / "postcode_lookup.parquet"
+
+# Persistent raw -> canonical address dictionary, shared by all cities and runs.
+ADDRESS_DICTIONARY_FILE = DATA_DIR / "address_dictionary.parquet"
+
+# Replace the raw 'postcode_district' categorical with its encodings in the model.
+# The lookup tables are stored with each registered model version.
+USE_TARGET_ENCODING = False
+
+# National repeat-sales house price index (district x month), shared by all cities.
+RAW_PRICE_HISTORY_FILE = DATA_DIR / "pp-complete.csv"
+HPI_FILE = DATA_DIR / "hpi_district_monthly.parquet"
+
+
+def city_slug(city: str) -> str:
+    """File-name form of a city, e.g. 'NEWCASTLE UPON TYNE' -> 'newcastle_upon_tyne'."""
+    slug = re.sub(r"[^a-z0-9]+", "_", city.lower()).strip("_")
+    if not slug:
+        raise ValueError(f"Invalid city name: {city!r}")
+    return slug
+
+
+def city_paths(city: str) -> dict:
+    """Model-ready data and model locations for any city, following the naming scheme below."""
+    slug = city_slug(city)
+    return {
+        "MODEL_READY_FILE": DATA_DIR / f"final_model_ready_{slug}.parquet",
+        "MODEL_PATH": MODEL_DIR / f"catboost_{slug}_model.cbm",
+    }
+
+# NOTE: Importing this module has no filesystem side effects.
+# Each stage creates the output directories it writes to.
+
+# Per-city files are named from the city slug, so any town extracted by
+# prepare_comparison_city gets its own files instead of overwriting London's.
+CITY_SLUG = city_slug(CURRENT_CITY)
+RAW_PRICE_FILE = DATA_DIR / f"price_paid_{CITY_SLUG}.parquet"
+RAW_EPC_FILE = DATA_DIR / f"epc_{CITY_SLUG}.parquet"
+MERGED_FILE = DATA_DIR / f"merged_{CITY_SLUG}.parquet"
+MODEL_READY_FILE = city_paths(CURRENT_CITY)["MODEL_READY_FILE"]
+MODEL_PATH = city_paths(CURRENT_CITY)["MODEL_PATH"]
+FIGURE_PATH_CURVE = FIGURES_DIR / f"green_premium_curve_{CITY_SLUG}.png"
+FIGURE_PATH_SUMMARY = FIGURES_DIR / f"shap_summary_{CITY_SLUG}.png"
+SPATIAL_FEATURES_FILE = DATA_DIR / f"spatial_features_{CITY_SLUG}.parquet"
+COMPS_INDEX_FILE = DATA_DIR / f"comps_index_{CITY_SLUG}.arrow"
+BACKTEST_REPORT_FILE = MODEL_DIR / f"backtest_{CITY_SLUG}.csv"
+
+BACKTEST_CACHE_DIR = MODEL_DIR / "backtest_cache"
+
+# MODEL REGISTRY
+REGISTRY_DIR = MODEL_DIR / "registry"
+REGISTRY_INDEX_FILE = REGISTRY_DIR / "registry.json"
+MODEL_CACHE_MAX_BYTES = 2 * 1024 ** 3  # Memory cap for hot models in a serving process
+
+# CROSS-CITY COMPARISON
+# Comma-separated override via ECOVALUATE_COMPARISON_CITIES (the CLI sets it from 'compare --cities').
+COMPARISON_CITIES = os.environ.get("ECOVALUATE_COMPARISON_CITIES", "LONDON,LEEDS").upper().split(",")
+COMPARISON_REPORT_FILE = FIGURES_DIR / "green_premium_comparison.csv"
 
 RANDOM_SEED = 42
 TEST_SIZE = 0.2
\ No newline at end of file
@@ -0,0 +1,142 @@
+"""
+Unified command-line entry point for the Eco-Valuate pipeline.
+
+    python src/ecovaluate.py --help
+    python src/ecovaluate.py --city LEEDS train
+    python src/ecovaluate.py --profile merge
+    python src/ecovaluate.py compare --cities LONDON,LEEDS,MANCHESTER
+
+Only the standard library is imported at start-up. Each subcommand imports its
+stage module (and therefore Polars, CatBoost, SHAP, ...) when it actually runs,
+so lightweight commands such as --help, 'config' or 'registry' start instantly.
+"""
+import os
+import re
+import sys
+import argparse
+import importlib
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent))
+
+# subcommand -> (module, [entry point functions], help)
+STAGES = {
+    "filter-london": ("filter_data", ["process_price_paid_data", "process_epc_data"],
+                      "Ingest raw Price Paid + EPC data for London"),
+    "prepare-city": ("prepare_comparison_city", ["filter_comparison_city"],
+                     "Ingest raw Price Paid + EPC data for a control city"),
+    "merge": ("merge_data", ["run_merge_pipeline"],
+              "Join Price Paid and EPC records on postcode + normalised address"),
+    "merge-features-parallel": ("partitioned_pipeline", ["run_partitioned_pipeline"],
+                                "Merge + feature engineering per postcode area across all cores"),
+    "hpi": ("house_price_index", ["build_house_price_index"],
+            "Build the district-level repeat-sales HPI deflator table"),
+    "features": ("feature_engineering", ["perform_feature_engineering"],
+                 "Build the model-ready dataset"),
+    "spatial": ("spatial_features", ["build_spatial_features"],
+                "Add k-nearest comparable-sales features"),
+    "comps-index": ("comps_index", ["build_comps_index"],
+                    "Build the memory-mapped comparable-sales index"),
+    "train": ("train_model", ["train_price_model"],
+              "Train and register the CatBoost valuation model"),
+    "backtest": ("backtest_model", ["run_backtest"],
+                 "Walk-forward time-based backtest"),
+    "explain": ("explain_model", ["explain_model_predictions"],
+                "Generate SHAP summary and Green Premium plots"),
+    "compare": ("compare_cities", ["compare_green_premiums"],
+                "Bootstrap Green Premium comparison across cities"),
+}
+
+
+def show_config():
+    import config as cfg
+
+    print(f"CURRENT_CITY: {cfg.CURRENT_CITY}")
+    for name in sorted(vars(cfg)):
+        value = getattr(cfg, name)
+        if name.isupper() and isinstance(value, Path):
+            print(f"{name}: {value}")
+
+
+def run_registry(args):
+    import model_registry
+
+    if args.action == "rollback":
+        version_id = model_registry.rollback(args.registry_city)
+        print(f"{args.registry_city.upper()} now serves model version: {version_id}")
+    elif args.action == "activate":
+        model_registry.set_active(args.registry_city, args.version)
+        print(f"{args.registry_city.upper()} now serves model version: {args.version}")
+    else:
+        model_registry.print_registry()
+
+
+def city_name(value: str) -> str:
+    # Town names as they appear in Price Paid data, e.g. LEEDS or NEWCASTLE UPON TYNE
+    if not re.fullmatch(r"[A-Za-z][A-Za-z' -]*", value.strip()):
+        raise argparse.ArgumentTypeError(f"invalid city name: {value!r}")
+    return value.strip().upper()
+
+
+def city_list(value: str) -> list:
+    return [city_name(city) for city in value.split(",")]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="ecovaluate", description="Eco-Valuate UK pipeline")
+    parser.add_argument("--city", type=city_name, help="City to run for (e.g. LONDON, LEEDS). Defaults to config.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record CPU stacks, memory and Polars query plans under profiles/")
+    subparsers = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    stage_parsers = {name: subparsers.add_parser(name, help=help_text) for name, (_, _, help_text) in STAGES.items()}
+    stage_parsers["compare"].add_argument(
+        "--cities", type=city_list, help="Comma-separated cities to compare (e.g. LONDON,LEEDS,MANCHESTER)"
+    )
+
+    subparsers.add_parser("config", help="Print the resolved configuration")
+
+    registry = subparsers.add_parser("registry", help="List, activate or roll back registered models")
+    registry.add_argument("action", nargs="?", choices=["list", "activate", "rollback"], default="list")
+    registry.add_argument("registry_city", nargs="?", metavar="city")
+    registry.add_argument("version", nargs="?")
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    # Must happen before config is first imported: stage modules read it at import time
+    if args.city:
+        os.environ["ECOVALUATE_CITY"] = args.city
+    if args.profile:
+        os.environ["ECOVALUATE_PROFILE"] = "1"
+    if getattr(args, "cities", None):
+        os.environ["ECOVALUATE_COMPARISON_CITIES"] = ",".join(args.cities)
+
+    # filter_data only extracts London, so it must never write to another city's files
+    if args.command == "filter-london" and os.environ.get("ECOVALUATE_CITY", "LONDON").upper() != "LONDON":
+        print("'filter-london' only runs for LONDON. Use 'prepare-city' for other cities.")
+        return 2
+
+    if args.command == "config":
+        show_config()
+    elif args.command == "registry":
+        if args.action != "list" and not args.registry_city:
+            print(f"'registry {args.action}' needs a city.")
+            return 2
+        if args.action == "activate" and not args.version:
+            print("'registry activate' needs a version id.")
+            return 2
+        run_registry(args)
+    else:
+        module_name, entry_points, _ = STAGES[args.command]
+        module = importlib.import_module(module_name)
+        for entry_point in entry_points:
+            getattr(module, entry_point)()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
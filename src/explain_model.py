@@ -1,18 +1,20 @@
 import sys
 import shap
 import config as cfg
+import profiling
 import polars as pl
 import matplotlib.ticker as ticker
 import matplotlib.pyplot as plt
-from catboost import CatBoostRegressor
 from pathlib import Path
+from train_model import prepare_registered_features
+from model_registry import ModelCache
 
 # CONFIGURATION
 sys.path.append(str(Path(__file__).parent))
 INPUT_FILE = cfg.MODEL_READY_FILE
-MODEL_PATH = cfg.MODEL_PATH
 FIGURES_DIR = cfg.FIGURES_DIR
 
+@profiling.profiled("explain")
 def explain_model_predictions():
     """
     Generates SHAP (SHapley Additive exPlanations) values to interpret model decisions.
@@ -24,8 +26,16 @@ def explain_model_predictions():
     print("Initializing SHAP explanation pipeline...")
 
     # 1. Validation and Setup
-    if not INPUT_FILE.exists() or not MODEL_PATH.exists():
-        print(f"Required files not found.\nInput: {INPUT_FILE}\nModel: {MODEL_PATH}")
+    if not INPUT_FILE.exists():
+        print(f"Required file not found.\nInput: {INPUT_FILE}")
+        return
+
+    # The city's active registry version, with the encodings it was trained with
+    print("Loading trained CatBoost Regressor...")
+    try:
+        model, lookups, model_info = ModelCache().load(cfg.CURRENT_CITY)
+    except KeyError as e:
+        print(f"No usable registered model: {e.args[0]}. Run the training stage first.")
         return
 
     if not FIGURES_DIR.exists():
@@ -37,40 +47,24 @@ def explain_model_predictions():
     print(f"Loading dataset from {INPUT_FILE}...")
     df = pl.read_parquet(INPUT_FILE)
 
-    # Extract Postcode District (e.g., 'SW1A' from 'SW1A 1AA')
-    df = df.with_columns(
-        pl.col("postcode").str.split(" ").list.first().alias("postcode_district")
-    )
-
-    # Define the exact feature set used in the CatBoost model
-    feature_cols = [
-        "TOTAL_FLOOR_AREA",
-        "energy_rating_rank",
-        "transaction_year",
-        "property_type",
-        "old_new",
-        "town",
-        "postcode_district"
-    ]
-
     # 3. Sampling
     # SHAP TreeExplainer is computationally intensive (`O(TLD^2)` complexity).
     # A random sample of 5,000 instances provides a statistically significant
     # approximation of the global distribution without excessive runtime.
     print("Sampling data (N=5000) for efficient computation...")
-    X_sample = df.select(feature_cols).sample(5000, seed=42).to_pandas()
-
-    # 4. Model Loading
-    print("Loading trained CatBoost Regressor...")
-    model = CatBoostRegressor()
-    model.load_model(str(MODEL_PATH))
+    # Features (and location encodings) follow the model's registry entry, exactly as at inference time
+    try:
+        X_sample, _ = prepare_registered_features(df.sample(5000, seed=42), model_info, lookups)
+    except KeyError as e:
+        print(f"No usable registered model: {e.args[0]}")
+        return
 
-    # 5. SHAP Value Calculation
+    # 4. SHAP Value Calculation
     print("Computing SHAP values using TreeExplainer...")
     explainer = shap.TreeExplainer(model)
     shap_values = explainer.shap_values(X_sample)
 
-    # 6. Visualization: Global Feature Importance
+    # 5. Visualization: Global Feature Importance
     print("Generating SHAP Summary Plot...")
     fig, ax = plt.subplots(figsize=(12, 8))
     shap.summary_plot(shap_values, X_sample, show=False)
@@ -85,7 +79,7 @@ def explain_model_predictions():
     print(f"[SUCCESS] Cleaned summary plot saved to: {summary_plot_path}")
     plt.close()
 
-    # 7. Visualization: Green Premium Analysis (Dependence Plot)
+    # 6. Visualization: Green Premium Analysis (Dependence Plot)
     # This plot isolates the effect of 'energy_rating_rank' on the predicted price.
     # We disable interaction_index to view the clean, marginal effect of the rating.
     print("Generating Green Premium Dependence Plot...")
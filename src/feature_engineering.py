@@ -1,21 +1,279 @@
 import sys
 import polars as pl
 import config as cfg
+import profiling
 from pathlib import Path
 
 
 sys.path.append(str(Path(__file__).parent))
 INPUT_FILE = cfg.MERGED_FILE
 OUTPUT_FILE = cfg.MODEL_READY_FILE
+HPI_FILE = cfg.HPI_FILE
 
+# TARGET / FREQUENCY ENCODING
+# High-cardinality location keys are replaced by numeric statistics of the sale price.
+ENCODING_KEYS = {
+    "district": ["postcode_district"],
+    "district_year": ["postcode_district", "transaction_year"]
+}
+ENCODED_COLS = [
+    f"{name}_{stat}" for name in ENCODING_KEYS for stat in ["count", "te_price", "te_ppsqm"]
+]
+N_FOLDS = 5  # Out-of-fold encoding folds
+SMOOTHING = 20  # Pseudo-count pulling rare keys towards their prior
+# Prior each key is smoothed towards (and unseen keys fall back to): a district x year
+# backs off to its district, a district to the global mean (stored as PRIOR_TABLE).
+ENCODING_BACKOFF = {"district": None, "district_year": "district"}
+PRIOR_TABLE = "prior"
+FOLD_COLUMNS = ["postcode", "date", "price", "TOTAL_FLOOR_AREA"]
+SUM_COLS = ["n", "price_sum", "ppsqm_sum"]
 
+
+def _sums() -> list:
+    return [
+        pl.len().alias("n"),
+        pl.col("price").sum().alias("price_sum"),
+        pl.col("price_per_sqm").sum().alias("ppsqm_sum")
+    ]
+
+
+def _smoothed(total: pl.Expr, n: pl.Expr, prior: pl.Expr) -> pl.Expr:
+    return (total + SMOOTHING * prior) / (n + SMOOTHING)
+
+
+def _with_fold(df):
+    # Folds come from row content, not row position, so a row lands in the same fold
+    # however the data is split into partitions or ordered
+    return df.with_columns(
+        (pl.struct(FOLD_COLUMNS).hash(cfg.RANDOM_SEED) % N_FOLDS).alias("_fold")
+    )
+
+
+def fit_encoding_stats(q: pl.LazyFrame) -> dict:
+    """
+    Sufficient statistics for the encodings: row count and price sums per key and fold.
+    They have one row per key x fold, so they stay small for any input size, and
+    stats from separate partitions can be merged with combine_encoding_stats().
+    """
+    q = _with_fold(q)
+    queries = [q.group_by(keys + ["_fold"]).agg(_sums()) for keys in ENCODING_KEYS.values()]
+    return dict(zip(ENCODING_KEYS, pl.collect_all(queries)))
+
+
+def combine_encoding_stats(parts: list) -> dict:
+    return {
+        name: pl.concat([part[name] for part in parts])
+        .group_by(keys + ["_fold"])
+        .agg(pl.col(SUM_COLS).sum())
+        for name, keys in ENCODING_KEYS.items()
+    }
+
+
+def _te_cols(name: str) -> list:
+    return [f"{name}_te_price", f"{name}_te_ppsqm"]
+
+
+def encode_with_stats(df: pl.DataFrame, stats: dict) -> tuple:
+    """
+    Adds out-of-fold ENCODED_COLS to df from precomputed stats (which must cover df's rows).
+    Returns the frame and full-data lookup tables: one per key, plus PRIOR_TABLE.
+    """
+    df = _with_fold(df.drop([col for col in ENCODED_COLS if col in df.columns]))
+
+    lookups, oof_tables = {}, {}
+    for name, keys in ENCODING_KEYS.items():
+        key_fold_stats = stats[name]
+        key_stats = key_fold_stats.group_by(keys).agg(pl.col(SUM_COLS).sum())
+        parent = ENCODING_BACKOFF[name]
+
+        if parent is None:
+            fold_stats = key_fold_stats.group_by("_fold").agg(pl.col(SUM_COLS).sum())
+            n, price_sum, ppsqm_sum = fold_stats.select(pl.col(SUM_COLS).sum()).row(0)
+            lookups[PRIOR_TABLE] = pl.DataFrame({"te_price": [price_sum / n], "te_ppsqm": [ppsqm_sum / n]})
+            full_prior = key_stats.with_columns([
+                pl.lit(price_sum / n).alias("prior_price"),
+                pl.lit(ppsqm_sum / n).alias("prior_ppsqm")
+            ])
+            # Out-of-fold priors: the global means without each fold
+            oof_prior = key_fold_stats.join(
+                fold_stats.select([
+                    "_fold",
+                    ((price_sum - pl.col("price_sum")) / (n - pl.col("n"))).alias("prior_price"),
+                    ((ppsqm_sum - pl.col("ppsqm_sum")) / (n - pl.col("n"))).alias("prior_ppsqm")
+                ]),
+                on="_fold"
+            )
+        else:
+            parent_keys = ENCODING_KEYS[parent]
+            prior_names = {col: alias for col, alias in zip(_te_cols(parent), ["prior_price", "prior_ppsqm"])}
+            full_prior = key_stats.join(
+                lookups[parent].select(parent_keys + _te_cols(parent)).rename(prior_names), on=parent_keys
+            )
+            oof_prior = key_fold_stats.join(
+                oof_tables[parent].rename(prior_names), on=parent_keys + ["_fold"]
+            )
+
+        lookups[name] = full_prior.select(keys + [
+            pl.col("n").alias(f"{name}_count"),
+            _smoothed(pl.col("price_sum"), pl.col("n"), pl.col("prior_price")).alias(f"{name}_te_price"),
+            _smoothed(pl.col("ppsqm_sum"), pl.col("n"), pl.col("prior_ppsqm")).alias(f"{name}_te_ppsqm")
+        ])
+
+        oof_tables[name] = (
+            oof_prior
+            .join(key_stats, on=keys, suffix="_all")
+            .select(keys + [
+                "_fold",
+                _smoothed(
+                    pl.col("price_sum_all") - pl.col("price_sum"), pl.col("n_all") - pl.col("n"), pl.col("prior_price")
+                ).alias(f"{name}_te_price"),
+                _smoothed(
+                    pl.col("ppsqm_sum_all") - pl.col("ppsqm_sum"), pl.col("n_all") - pl.col("n"), pl.col("prior_ppsqm")
+                ).alias(f"{name}_te_ppsqm")
+            ])
+        )
+
+        df = (
+            df.join(lookups[name].select(keys + [f"{name}_count"]), on=keys, how="left")
+            .join(oof_tables[name], on=keys + ["_fold"], how="left")
+        )
+
+    return df.drop("_fold"), lookups
+
+
+def compute_target_encodings(df: pl.DataFrame) -> tuple:
+    """
+    Leakage-safe target and frequency encodings for each key in ENCODING_KEYS.
+
+    Rows are assigned to N_FOLDS deterministic folds. A row's target statistics
+    come only from the other folds (total minus own fold, all via group-bys), so
+    its own price never leaks into its features. Counts are plain frequencies.
+
+    Returns the frame with ENCODED_COLS added, and full-data lookup tables
+    (one per key) for scoring rows that were not part of training.
+    """
+    return encode_with_stats(df, fit_encoding_stats(df.lazy()))
+
+
+def apply_target_encodings(df: pl.DataFrame, lookups: dict) -> pl.DataFrame:
+    """
+    Attaches encodings from lookup tables (test split, inference, SHAP, counterfactuals).
+    A registered model's tables are stored with it (model_registry.ModelCache.load).
+    Existing encoded columns (e.g. out-of-fold training values) are replaced.
+    Keys never seen in training get a zero count and the value of their backoff
+    (ENCODING_BACKOFF), i.e. the n=0 case of the smoothing, never nulls: the
+    training features have none, so CatBoost would route them arbitrarily.
+    """
+    df = df.drop([col for col in ENCODED_COLS if col in df.columns])
+    prior = lookups[PRIOR_TABLE].row(0, named=True)
+    for name, keys in ENCODING_KEYS.items():
+        parent = ENCODING_BACKOFF[name]
+        fallbacks = (
+            [pl.lit(prior["te_price"]), pl.lit(prior["te_ppsqm"])] if parent is None
+            else [pl.col(col) for col in _te_cols(parent)]
+        )
+        df = df.join(lookups[name], on=keys, how="left").with_columns(
+            [pl.col(f"{name}_count").fill_null(0)]
+            + [pl.col(col).fill_null(fallback) for col, fallback in zip(_te_cols(name), fallbacks)]
+        )
+    return df
+
+
+def add_oof_encodings(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Adds city-wide out-of-fold encodings to the model-ready frame for analysis.
+    Training refits them on its own training split, and the lookup tables used
+    for scoring are stored with each registered model, not here.
+    """
+    df, lookups = compute_target_encodings(df)
+    print(f"Encoded {', '.join(f'{name} ({table.height:,} keys)' for name, table in lookups.items() if name != PRIOR_TABLE)}")
+    return df
+
+
+def add_real_prices(q: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Deflates prices with the district-level repeat-sales HPI (see house_price_index.py).
+    'real_price' is expressed in pounds of the latest indexed month. Rows whose
+    district has no index keep a null real price.
+    """
+    if not HPI_FILE.exists():
+        print(f"HPI table not found at {HPI_FILE}. Skipping real-terms prices.")
+        return q
+
+    deflators = pl.scan_parquet(HPI_FILE).select([
+        "postcode_district", "transaction_year", "transaction_month", "deflator"
+    ])
+
+    return (
+        q.join(deflators, on=["postcode_district", "transaction_year", "transaction_month"], how="left")
+        .with_columns(
+            (pl.col("price") * pl.col("deflator")).alias("real_price")
+        )
+        .with_columns(
+            (pl.col("real_price") / pl.col("TOTAL_FLOOR_AREA")).alias("real_price_per_sqm")
+        )
+    )
+
+
+def build_feature_query(q: pl.LazyFrame) -> pl.LazyFrame:
+    """Lazy feature pipeline over merged rows (shared with the partitioned executor)."""
+    return (
+        q
+        # 1. TEMPORAL FEATURES (Handling Inflation)
+        # By providing Year and Month, the model can learn the 'Time Trend'
+        # (i.e., inflation/HPI) independently from the 'Green Premium'.
+        .with_columns([
+            pl.col("date").dt.year().alias("transaction_year"),
+            pl.col("date").dt.month().alias("transaction_month"),
+            pl.col("date").dt.quarter().alias("transaction_quarter"),
+            # Postcode District (e.g., 'SW1A' from 'SW1A 1AA')
+            pl.col("postcode").str.split(" ").list.first().alias("postcode_district")
+        ])
+
+        # Real-terms prices from the repeat-sales HPI (optional)
+        .pipe(add_real_prices)
+
+        # 2. FEATURE CREATION
+        # Price per square meter calculation
+        .with_columns(
+            (pl.col("price") / pl.col("TOTAL_FLOOR_AREA")).alias("price_per_sqm")
+        )
+
+        # Encode Energy Rating: A (Best) -> 7, G (Worst) -> 1
+        .with_columns(
+            pl.col("CURRENT_ENERGY_RATING").replace({
+                "A": 7, "B": 6, "C": 5, "D": 4, "E": 3, "F": 2, "G": 1
+            }, default=None).cast(pl.Int32).alias("energy_rating_rank")
+        )
+
+        # 3. OUTLIER REMOVAL & CLEANING
+        # Filtering unrealistic properties to prevent model skew.
+        .filter(
+            (pl.col("TOTAL_FLOOR_AREA") > 20) &  # Exclude tiny units (<20m2)
+            (pl.col("TOTAL_FLOOR_AREA") < 500) &  # Exclude mega-mansions (>500m2)
+            (pl.col("price") > 50_000) &  # Exclude derelict/auction properties
+            (pl.col("price") < 5_000_000) &  # Exclude ultra-luxury segment
+            (pl.col("energy_rating_rank").is_not_null())  # Ensure valid energy data
+        )
+
+        # Handle Missing Categorical Values
+        .with_columns([
+            pl.col("property_type").fill_null("Other"),
+            pl.col("BUILT_FORM").fill_null("Unknown")
+        ])
+    )
+
+
+@profiling.profiled("features")
 def perform_feature_engineering():
     """
     Transforms the raw merged dataset into a model-ready format.
     1. Temporal Feature Extraction: Allows the model to account for inflation/HPI.
     2. Unit Price Calculation: Price per sqm is a more comparable metric.
+       If an HPI deflator table exists, real-terms prices are added as well.
     3. Ordinal Encoding: Converts Energy Ratings (A-G) to numeric ranks (7-1).
     4. Outlier Removal: Filters extreme values to ensure model stability.
+    5. Target Encoding: Out-of-fold price statistics per district and district x year.
     """
     print("Starting feature engineering pipeline...")
 
@@ -25,52 +283,16 @@ def perform_feature_engineering():
 
     try:
         # Use LazyFrame for memory efficiency
-        q = (
-            pl.scan_parquet(INPUT_FILE)
-
-            # 1. TEMPORAL FEATURES (Handling Inflation)
-            # By providing Year and Month, the model can learn the 'Time Trend'
-            # (i.e., inflation/HPI) independently from the 'Green Premium'.
-            .with_columns([
-                pl.col("date").dt.year().alias("transaction_year"),
-                pl.col("date").dt.month().alias("transaction_month"),
-                pl.col("date").dt.quarter().alias("transaction_quarter")
-            ])
-
-            # 2. FEATURE CREATION
-            # Price per square meter calculation
-            .with_columns(
-                (pl.col("price") / pl.col("TOTAL_FLOOR_AREA")).alias("price_per_sqm")
-            )
-
-            # Encode Energy Rating: A (Best) -> 7, G (Worst) -> 1
-            .with_columns(
-                pl.col("CURRENT_ENERGY_RATING").replace({
-                    "A": 7, "B": 6, "C": 5, "D": 4, "E": 3, "F": 2, "G": 1
-                }, default=None).cast(pl.Int32).alias("energy_rating_rank")
-            )
-
-            # 3. OUTLIER REMOVAL & CLEANING
-            # Filtering unrealistic properties to prevent model skew.
-            .filter(
-                (pl.col("TOTAL_FLOOR_AREA") > 20) &  # Exclude tiny units (<20m2)
-                (pl.col("TOTAL_FLOOR_AREA") < 500) &  # Exclude mega-mansions (>500m2)
-                (pl.col("price") > 50_000) &  # Exclude derelict/auction properties
-                (pl.col("price") < 5_000_000) &  # Exclude ultra-luxury segment
-                (pl.col("energy_rating_rank").is_not_null())  # Ensure valid energy data
-            )
-
-            # Handle Missing Categorical Values
-            .with_columns([
-                pl.col("property_type").fill_null("Other"),
-                pl.col("BUILT_FORM").fill_null("Unknown")
-            ])
-        )
+        q = build_feature_query(pl.scan_parquet(INPUT_FILE))
 
         # Execute Pipeline
-        df_final = q.collect()
+        df_final = profiling.collect(q, "feature_engineering")
+
+        # 4. TARGET / FREQUENCY ENCODING
+        # Needs the whole city at once, so it runs after the lazy query.
+        df_final = add_oof_encodings(df_final)
 
-        # 4. REPORTING
+        # 5. REPORTING
         print("Feature engineering complete.")
         print(f"Final Dataset Size: {df_final.shape[0]:,} rows")
 
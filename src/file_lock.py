@@ -0,0 +1,29 @@
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path: Path):
+    """
+    Exclusive lock for a read-modify-write of a file shared between runs
+    (e.g. two cities merging or training at the same time).
+
+    The lock is taken on a '<name>.lock' sidecar so the data file itself can still
+    be replaced atomically with os.replace. Blocks until the lock is free.
+    """
+    lock_file = path.with_name(f"{path.name}.lock")
+    lock_file.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
@@ -1,5 +1,6 @@
 import polars as pl
 import config as cfg
+import profiling
 from pathlib import Path
 import sys
 
@@ -12,6 +13,7 @@ PRICE_PROCESSED_PATH = cfg.RAW_PRICE_FILE
 EPC_PROCESSED_PATH = cfg.RAW_EPC_FILE
 
 
+@profiling.profiled("filter_price")
 def process_price_paid_data():
     """
     Ingests raw HM Land Registry Price Paid Data, applies filtering for
@@ -50,7 +52,7 @@ def process_price_paid_data():
         )
 
         # Execute the query
-        df_price = q.collect()
+        df_price = profiling.collect(q, "price_paid_scan")
         print(f"Price Paid Data processed. Rows: {df_price.shape[0]}")
 
         df_price.write_parquet(PRICE_PROCESSED_PATH)
@@ -60,6 +62,7 @@ def process_price_paid_data():
         print(f"Failed to process Price Paid Data: {e}")
 
 
+@profiling.profiled("filter_epc")
 def process_epc_data():
     """
     Ingests raw EPC certificates, selects key energy efficiency metrics,
@@ -83,7 +86,7 @@ def process_epc_data():
             .filter(pl.col("POSTCODE").is_not_null())
         )
 
-        df_epc = q.collect()
+        df_epc = profiling.collect(q, "epc_scan")
         print(f"EPC Data processed. Rows: {df_epc.shape[0]}")
 
         df_epc.write_parquet(EPC_PROCESSED_PATH)
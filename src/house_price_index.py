@@ -0,0 +1,197 @@
+import os
+import sys
+import numpy as np
+import polars as pl
+import config as cfg
+import profiling
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
+from scipy.sparse.linalg import lsqr
+from pathlib import Path
+from merge_data import normalize_address_string
+
+sys.path.append(str(Path(__file__).parent))
+
+INPUT_FILE = cfg.RAW_PRICE_HISTORY_FILE
+OUTPUT_FILE = cfg.HPI_FILE
+
+BASE_YEAR = 1995  # First year of the Land Registry Price Paid history
+MIN_PAIRS = 50  # Districts with fewer repeat-sale pairs get no index
+MAX_ABS_LOG_RETURN = np.log(4)  # Drop pairs whose price moved more than 4x (likely rebuilds/errors)
+
+PPD_COLS = [
+    "id", "price", "date", "postcode", "property_type",
+    "old_new", "duration", "paon", "saon", "street",
+    "locality", "town", "district", "county", "ppd_cat", "status"
+]
+
+
+def build_repeat_sales_pairs() -> pl.DataFrame:
+    """
+    Finds consecutive sales of the same property in the national history.
+
+    A property is identified by postcode + normalised address, using the same
+    'clean_addr_price' key as the merge pipeline. Each row of the result is one
+    (earlier sale, later sale) pair with its log price change.
+    """
+    q = (
+        pl.scan_csv(INPUT_FILE, has_header=False, new_columns=PPD_COLS)
+        # Standard price paid entries only (category B covers repossessions, transfers, etc.)
+        .filter(pl.col("ppd_cat") == "A")
+        .filter(pl.col("postcode").is_not_null())
+        .with_columns([
+            pl.col("date").str.to_datetime("%Y-%m-%d %H:%M"),
+            (pl.col("postcode").str.replace(" ", "")).alias("join_pcode"),
+            pl.col("postcode").str.split(" ").list.first().alias("postcode_district"),
+            pl.concat_str([
+                pl.col("saon").fill_null(""),
+                pl.col("paon").fill_null(""),
+                pl.col("street").fill_null("")
+            ], separator=" ").alias("full_address_raw")
+        ])
+        .pipe(normalize_address_string, "full_address_raw", "clean_addr_price")
+        .with_columns(
+            ((pl.col("date").dt.year() - BASE_YEAR) * 12 + pl.col("date").dt.month() - 1)
+            .cast(pl.Int32).alias("month_idx")
+        )
+        .select(["postcode_district", "join_pcode", "clean_addr_price", "month_idx", "price"])
+        .sort(["join_pcode", "clean_addr_price", "month_idx"])
+        .with_columns([
+            pl.col("month_idx").shift(1).over(["join_pcode", "clean_addr_price"]).alias("prev_month_idx"),
+            pl.col("price").shift(1).over(["join_pcode", "clean_addr_price"]).alias("prev_price")
+        ])
+        .filter(pl.col("prev_price").is_not_null())
+        .with_columns(
+            (pl.col("price").log() - pl.col("prev_price").log()).alias("log_return")
+        )
+        # Same-month resales carry no index information; extreme moves are renovations or errors
+        .filter(
+            (pl.col("month_idx") > pl.col("prev_month_idx")) &
+            (pl.col("log_return").abs() < MAX_ABS_LOG_RETURN)
+        )
+        .select([
+            "postcode_district",
+            pl.col("prev_month_idx").alias("t0"),
+            pl.col("month_idx").alias("t1"),
+            "log_return"
+        ])
+    )
+    return profiling.collect(q, "repeat_sales_pairs")
+
+
+def estimate_district_index(task: tuple) -> pl.DataFrame:
+    """
+    Case-Shiller weighted repeat-sales regression for one district.
+
+    The design matrix has one column per month (minus the base month) with
+    -1 at the earlier sale and +1 at the later sale. It is solved three times:
+    1. OLS for the log index.
+    2. Squared residuals regressed on the holding period (noise grows with time).
+    3. Weighted least squares using the inverse of the fitted variance.
+    """
+    district, t0, t1, y = task
+
+    # Only months that actually appear in this district become columns
+    months, inverse = np.unique(np.concatenate([t0, t1]), return_inverse=True)
+    col0, col1 = inverse[:len(t0)], inverse[len(t0):]
+    n_pairs, n_months = len(y), len(months)
+
+    rows = np.concatenate([np.arange(n_pairs), np.arange(n_pairs)])
+    cols = np.concatenate([col0, col1])
+    vals = np.concatenate([-np.ones(n_pairs), np.ones(n_pairs)])
+    X = sparse.csr_matrix((vals, (rows, cols)), shape=(n_pairs, n_months))[:, 1:]  # Drop base month
+
+    # Stage 1: OLS
+    beta = lsqr(X, y, atol=1e-10, btol=1e-10)[0]
+    residuals = y - X @ beta
+
+    # Stage 2: Variance as a linear function of the holding period
+    gap = (t1 - t0).astype(np.float64)
+    G = np.column_stack([np.ones(n_pairs), gap])
+    coef, *_ = np.linalg.lstsq(G, residuals ** 2, rcond=None)
+    variance = np.clip(G @ coef, 1e-6, None)
+
+    # Stage 3: WLS via row scaling
+    w = 1.0 / np.sqrt(variance)
+    beta = lsqr(sparse.diags(w) @ X, y * w, atol=1e-10, btol=1e-10)[0]
+
+    return pl.DataFrame({
+        "postcode_district": [district] * n_months,
+        "month_idx": months.astype(np.int32),
+        "hpi": np.exp(np.concatenate([[0.0], beta]))
+    })
+
+
+@profiling.profiled("hpi")
+def build_house_price_index():
+    """
+    Builds a district-level monthly repeat-sales house price index.
+    1. Pair Construction: Consecutive sales of the same normalised address.
+    2. Regression: Weighted repeat-sales regression per district, in parallel.
+    3. Deflators: Forward-filled monthly index rebased to the latest month, so
+       price * deflator gives a real-terms price in latest-month pounds.
+    """
+    print("Starting repeat-sales HPI pipeline...")
+
+    if not INPUT_FILE.exists():
+        print(f"CRITICAL ERROR: {INPUT_FILE} not found. The full Price Paid history is required.")
+        return
+
+    try:
+        # 1. PAIR CONSTRUCTION
+        print("Finding repeat sales across the national history...")
+        pairs = build_repeat_sales_pairs()
+        print(f"Repeat-sale pairs found: {pairs.height:,}")
+
+        tasks = []
+        for (district,), group in pairs.partition_by("postcode_district", as_dict=True).items():
+            if group.height < MIN_PAIRS:
+                continue
+            tasks.append((
+                district,
+                group["t0"].to_numpy(),
+                group["t1"].to_numpy(),
+                group["log_return"].to_numpy()
+            ))
+        del pairs
+
+        # 2. REGRESSION (one district per task, spread across all cores)
+        print(f"Estimating index for {len(tasks):,} districts on {os.cpu_count()} cores...")
+        with ProcessPoolExecutor() as pool:
+            results = list(pool.map(estimate_district_index, tasks, chunksize=16))
+
+        # 3. DEFLATORS
+        # Months without sales in a district carry the previous month's index forward,
+        # up to the latest month nationally so every district shares the same base
+        hpi = pl.concat(results)
+        latest_month = hpi["month_idx"].max()
+        grid = (
+            hpi.group_by("postcode_district")
+            .agg(pl.int_range(pl.col("month_idx").min(), latest_month + 1).alias("month_idx"))
+            .explode("month_idx")
+            .with_columns(pl.col("month_idx").cast(pl.Int32))
+        )
+        df_final = (
+            grid.join(hpi, on=["postcode_district", "month_idx"], how="left")
+            .sort(["postcode_district", "month_idx"])
+            .with_columns(pl.col("hpi").forward_fill().over("postcode_district"))
+            .with_columns(
+                (pl.col("hpi").last().over("postcode_district") / pl.col("hpi")).alias("deflator"),
+                (pl.col("month_idx") // 12 + BASE_YEAR).cast(pl.Int32).alias("transaction_year"),
+                (pl.col("month_idx") % 12 + 1).cast(pl.Int8).alias("transaction_month")
+            )
+            .select(["postcode_district", "transaction_year", "transaction_month", "hpi", "deflator"])
+        )
+
+        print("HPI estimation complete.")
+        print(df_final.filter(pl.col("transaction_month") == 1).head(5))
+
+        df_final.write_parquet(OUTPUT_FILE)
+        print(f"\nDeflator table saved to: {OUTPUT_FILE}")
+
+    except Exception as e:
+        print(f"Error during HPI estimation: {e}")
+
+
+if __name__ == "__main__":
+    build_house_price_index()
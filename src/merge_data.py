@@ -1,6 +1,9 @@
+import os
 import sys
 import polars as pl
 import config as cfg
+import profiling
+from file_lock import file_lock
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).parent))
@@ -8,6 +11,16 @@ sys.path.append(str(Path(__file__).parent))
 PRICE_INPUT = cfg.RAW_PRICE_FILE
 EPC_INPUT = cfg.RAW_EPC_FILE
 OUTPUT_FILE = cfg.MERGED_FILE
+DICTIONARY_FILE = cfg.ADDRESS_DICTIONARY_FILE
+
+ADDRESS_HASH_SEED = 0
+DICTIONARY_SCHEMA = {
+    "raw_hash": pl.UInt64,
+    "raw_address": pl.Utf8,
+    "clean_address": pl.Utf8,
+    "clean_address_id": pl.UInt64,
+    "hash_version": pl.Utf8
+}
 
 
 def normalize_address_string(df: pl.LazyFrame, col_name: str, alias: str) -> pl.LazyFrame:
@@ -29,63 +42,207 @@ def normalize_address_string(df: pl.LazyFrame, col_name: str, alias: str) -> pl.
     )
 
 
-def run_merge_pipeline():
-    print("STARTING MERGE PIPELINE...")
+def price_raw_address() -> pl.Expr:
+    # Construct full address from PAON and SAON
+    return pl.concat_str([
+        pl.col("saon").fill_null(""),
+        pl.col("paon").fill_null(""),
+        pl.col("street").fill_null("")
+    ], separator=" ").alias("full_address_raw")
+
+
+def epc_raw_address() -> pl.Expr:
+    return pl.col("ADDRESS1").alias("raw_addr")
+
+
+def raw_address_hash(col_name: str) -> pl.Expr:
+    return pl.col(col_name).hash(seed=ADDRESS_HASH_SEED).alias("raw_hash")
+
+
+def update_address_dictionary(raw_addresses: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Adds unseen raw address strings to the persistent canonical-address dictionary.
+
+    The dictionary maps raw_hash + raw_address -> clean_address + clean_address_id and
+    is stored as parquet. Only strings missing from it go through the regex
+    normalisation, so repeat merges skip most of that cost. clean_address_id is a
+    stable id of the normalised string only: it carries no postcode, so every
+    "10 high street" shares one id. Identify a property by postcode + id, never by
+    the id alone.
+
+    raw_addresses must have a single 'raw_address' column.
+    """
+    raw = raw_addresses.filter(pl.col("raw_address").is_not_null()).unique()
+
+    # The file is shared by all cities: hold an exclusive lock from reading it to writing
+    # it back, so concurrent merges never allocate the same id twice or drop each other's entries
+    with file_lock(DICTIONARY_FILE):
+        changed = False
+        if DICTIONARY_FILE.exists():
+            dictionary = pl.read_parquet(DICTIONARY_FILE)
+            if "address_id" in dictionary.columns:  # Dictionaries written before the rename
+                dictionary = dictionary.rename({"address_id": "clean_address_id"})
+            # Polars does not guarantee hash stability across versions: rehash if it changed
+            if dictionary.height > 0 and dictionary["hash_version"][0] != pl.__version__:
+                print("Polars version changed since the dictionary was built. Rehashing raw addresses...")
+                dictionary = dictionary.with_columns([
+                    raw_address_hash("raw_address"),
+                    pl.lit(pl.__version__).alias("hash_version")
+                ])
+                changed = True
+        else:
+            dictionary = pl.DataFrame(schema=DICTIONARY_SCHEMA)
+
+        unseen = profiling.collect(
+            raw.with_columns(raw_address_hash("raw_address"))
+            .join(dictionary.lazy(), on=["raw_hash", "raw_address"], how="anti")
+            .pipe(normalize_address_string, "raw_address", "clean_address"),
+            "address_dictionary_unseen"
+        )
+        print(f"Address dictionary: {dictionary.height:,} known strings, {unseen.height:,} new.")
+
+        if unseen.height > 0:
+            # Reuse the id of an existing canonical address; otherwise allocate the next free ids
+            known_ids = dictionary.select(["clean_address", "clean_address_id"]).unique(subset="clean_address")
+            unseen = unseen.join(known_ids, on="clean_address", how="left")
+
+            next_id = (dictionary["clean_address_id"].max() or 0) + 1
+            new_ids = (
+                unseen.filter(pl.col("clean_address_id").is_null())
+                .select("clean_address")
+                .unique(maintain_order=True)
+                .with_row_index("offset")
+                .select([
+                    "clean_address",
+                    (pl.col("offset").cast(pl.UInt64) + next_id).alias("new_id")
+                ])
+            )
+            unseen = (
+                unseen.join(new_ids, on="clean_address", how="left")
+                .with_columns([
+                    pl.coalesce(["clean_address_id", "new_id"]).cast(pl.UInt64).alias("clean_address_id"),
+                    pl.lit(pl.__version__).alias("hash_version")
+                ])
+                .select(list(DICTIONARY_SCHEMA))
+            )
+            dictionary = pl.concat([dictionary, unseen])
+            changed = True
+
+        if changed:
+            # Write-then-rename so a killed run never leaves a half-written dictionary behind
+            DICTIONARY_FILE.parent.mkdir(exist_ok=True)
+            tmp_file = DICTIONARY_FILE.with_name(f"{DICTIONARY_FILE.stem}.{os.getpid()}.tmp")
+            dictionary.write_parquet(tmp_file)
+            os.replace(tmp_file, DICTIONARY_FILE)
+
+    return dictionary.lazy()
+
+
+def canonicalize_addresses(
+    q: pl.LazyFrame, col_name: str, alias: str, address_dictionary: pl.LazyFrame = None
+) -> pl.LazyFrame:
+    """
+    Resolves raw addresses to canonical ones (column 'alias') plus 'clean_address_id'.
+
+    With a dictionary, this is a hash join; without one, the regex normalisation
+    runs directly. Inputs that already carry the canonical column (e.g. partitions
+    pre-resolved by the partitioned executor) pass through untouched.
+    """
+    if alias in q.collect_schema().names():
+        return q
+    if address_dictionary is None:
+        return normalize_address_string(q, col_name, alias)
+
+    return (
+        q.with_columns(raw_address_hash(col_name))
+        .join(
+            address_dictionary.select(["raw_hash", "raw_address", "clean_address", "clean_address_id"]),
+            left_on=["raw_hash", col_name],
+            right_on=["raw_hash", "raw_address"],
+            how="left"
+        )
+        .rename({"clean_address": alias})
+        .drop("raw_hash")
+    )
 
-    # 1. PREPARE EPC DATA
-    print("Loading and cleaning EPC Data...")
 
+def prepare_epc(q_epc: pl.LazyFrame, address_dictionary: pl.LazyFrame = None) -> pl.LazyFrame:
     # Strategy: Sort by LMK_KEY (or date if available) and keep the most recent one per address.
     # For MVP, we group by POSTCODE + ADDRESS1 and keep the first one.
-
-    q_epc = (
-        pl.scan_parquet(EPC_INPUT)
+    q = (
+        q_epc
         .with_columns([
             # Create a clean join key combining Postcode + Address
             (pl.col("POSTCODE").str.replace(" ", "")).alias("join_pcode"),
-            pl.col("ADDRESS1").alias("raw_addr")
+            epc_raw_address()
         ])
         # Apply normalization to address
-        .pipe(normalize_address_string, "raw_addr", "clean_addr_epc")
+        .pipe(canonicalize_addresses, "raw_addr", "clean_addr_epc", address_dictionary)
         # Deduplicate: Keep one EPC per address (can be improved with date logic later)
         .unique(subset=["join_pcode", "clean_addr_epc"], keep="first")
     )
+    # The price side carries the address id; the matched EPC row has the same one
+    if "clean_address_id" in q.collect_schema().names():
+        q = q.drop("clean_address_id")
+    return q
 
-    # 2. PREPARE PRICE DATA
-    print("Loading and cleaning Price Data...")
 
-    q_price = (
-        pl.scan_parquet(PRICE_INPUT)
+def prepare_price(q_price: pl.LazyFrame, address_dictionary: pl.LazyFrame = None) -> pl.LazyFrame:
+    return (
+        q_price
         .with_columns([
             (pl.col("postcode").str.replace(" ", "")).alias("join_pcode"),
-
-            # Construct full address from PAON and SAON
-            pl.concat_str([
-                pl.col("saon").fill_null(""),
-                pl.col("paon").fill_null(""),
-                pl.col("street").fill_null("")
-            ], separator=" ").alias("full_address_raw")
+            price_raw_address()
         ])
         # Apply normalization
-        .pipe(normalize_address_string, "full_address_raw", "clean_addr_price")
+        .pipe(canonicalize_addresses, "full_address_raw", "clean_addr_price", address_dictionary)
     )
 
-    # 3. PERFORM JOIN
-    print("Executing Merge (Left Join Price -> EPC)...")
-
-    # We join on Postcode (exact) AND the Cleaned Address (exact)
-    # Note: This is a strict match. We might lose some data, but the matches will be high quality.
 
-    merged_df = (
-        q_price.join(
-            q_epc,
-            left_on=["join_pcode", "clean_addr_price"],
-            right_on=["join_pcode", "clean_addr_epc"],
-            how="inner"  # Use 'inner' to keep only sold houses with EPC data
-        )
-        .collect()
+def build_merge_query(
+    q_price: pl.LazyFrame, q_epc: pl.LazyFrame, address_dictionary: pl.LazyFrame = None
+) -> pl.LazyFrame:
+    """
+    Lazy Price -> EPC join on Postcode (exact) AND the Cleaned Address (exact).
+    Note: This is a strict match. We might lose some data, but the matches will be high quality.
+    Shared by the single-query pipeline below and the partitioned executor.
+    """
+    return prepare_price(q_price, address_dictionary).join(
+        prepare_epc(q_epc, address_dictionary),
+        left_on=["join_pcode", "clean_addr_price"],
+        right_on=["join_pcode", "clean_addr_epc"],
+        how="inner"  # Use 'inner' to keep only sold houses with EPC data
     )
 
+
+def collect_raw_addresses(q_price: pl.LazyFrame, q_epc: pl.LazyFrame) -> pl.LazyFrame:
+    """Every raw address string seen on either side of the merge."""
+    return pl.concat([
+        q_price.select(price_raw_address().alias("raw_address")),
+        q_epc.select(epc_raw_address().alias("raw_address"))
+    ])
+
+
+@profiling.profiled("merge")
+def run_merge_pipeline():
+    print("STARTING MERGE PIPELINE...")
+
+    q_price = pl.scan_parquet(PRICE_INPUT)
+    q_epc = pl.scan_parquet(EPC_INPUT)
+
+    # 1. CANONICAL ADDRESSES
+    # Only address strings never seen in a previous run are normalised
+    print("Updating canonical-address dictionary...")
+    address_dictionary = update_address_dictionary(collect_raw_addresses(q_price, q_epc))
+
+    # 2. PREPARE EPC + PRICE DATA
+    print("Loading and cleaning EPC and Price Data...")
+    q_merged = build_merge_query(q_price, q_epc, address_dictionary)
+
+    # 3. PERFORM JOIN
+    print("Executing Merge (Left Join Price -> EPC)...")
+    merged_df = profiling.collect(q_merged, "merge_join")
+
     row_count = merged_df.shape[0]
     print(f"MERGE COMPLETE. Final Dataset Rows: {row_count:,}")
 
@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import threading
+import config as cfg
+from file_lock import file_lock
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+REGISTRY_DIR = cfg.REGISTRY_DIR
+INDEX_FILE = cfg.REGISTRY_INDEX_FILE
+
+
+def fingerprint_file(path: Path, chunk_size: int = 1 << 20) -> str:
+    """Content hash of a data file (first 16 hex chars of BLAKE2b)."""
+    digest = hashlib.blake2b(digest_size=8)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_index() -> dict:
+    if not INDEX_FILE.exists():
+        return {}
+    return json.loads(INDEX_FILE.read_text())
+
+
+def _save_index(index: dict):
+    # Write-then-rename so readers never see a half-written index.
+    # Callers hold file_lock(INDEX_FILE) from load_index() to here.
+    tmp_file = INDEX_FILE.with_name(f"{INDEX_FILE.stem}.{os.getpid()}.tmp")
+    tmp_file.write_text(json.dumps(index, indent=2))
+    os.replace(tmp_file, INDEX_FILE)
+
+
+def _replace_file(write, target: Path):
+    """Writes via write(tmp_path), then renames into place, so a version re-registered
+    while it is being served never exposes a half-written file."""
+    tmp_file = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    write(tmp_file)
+    os.replace(tmp_file, target)
+
+
+def register_model(
+    model_path: Path,
+    city: str,
+    data_path: Path,
+    feature_spec_version: int,
+    feature_cols: list,
+    metrics: dict,
+    encodings: dict = None,
+) -> str:
+    """
+    Copies a trained model into the registry and makes it the active version for its city.
+
+    Versions are keyed by data fingerprint + feature-spec version, so retraining
+    on identical data with an identical feature spec replaces the same entry.
+    Target-encoding lookup tables the model was trained with ({name: DataFrame})
+    are stored next to it, so a rollback also restores the matching encodings.
+    Returns the version id.
+    """
+    REGISTRY_DIR.mkdir(parents=True, exist_ok=True)
+    city = city.upper()
+    version_id = f"{fingerprint_file(data_path)}-fs{feature_spec_version}"
+
+    target = REGISTRY_DIR / cfg.city_slug(city) / f"{version_id}.cbm"
+    target.parent.mkdir(exist_ok=True)
+
+    # Concurrent trainings (e.g. two cities) must not lose each other's index entries
+    with file_lock(INDEX_FILE):
+        _replace_file(lambda tmp_file: shutil.copyfile(model_path, tmp_file), target)
+
+        encoding_files = {}
+        for name, table in (encodings or {}).items():
+            encoding_file = target.with_name(f"{version_id}.{name}.parquet")
+            _replace_file(table.write_parquet, encoding_file)
+            encoding_files[name] = str(encoding_file.relative_to(REGISTRY_DIR))
+
+        index = load_index()
+        entry = index.setdefault(city, {"active": None, "versions": {}})
+        entry["versions"][version_id] = {
+            "model_file": str(target.relative_to(REGISTRY_DIR)),
+            "data_file": str(data_path),
+            "data_fingerprint": version_id.split("-fs")[0],
+            "feature_spec_version": feature_spec_version,
+            "features": list(feature_cols),
+            "encoding_files": encoding_files,
+            "metrics": metrics,
+            "registered_at": datetime.now(timezone.utc).isoformat(timespec="seconds")
+        }
+        entry["active"] = version_id
+        _save_index(index)
+    return version_id
+
+
+def list_versions(city: str) -> list:
+    """Versions of a city's model, oldest first."""
+    entry = load_index().get(city.upper(), {"versions": {}})
+    return sorted(entry["versions"].items(), key=lambda item: item[1]["registered_at"])
+
+
+def _set_active(index: dict, city: str, version_id: str):
+    if version_id not in index.get(city, {}).get("versions", {}):
+        raise KeyError(f"Unknown model version for {city}: {version_id}")
+    index[city]["active"] = version_id
+    _save_index(index)
+
+
+def set_active(city: str, version_id: str):
+    """Points a city at a specific registered version (promotion or rollback)."""
+    with file_lock(INDEX_FILE):
+        _set_active(load_index(), city.upper(), version_id)
+
+
+def rollback(city: str) -> str:
+    """Re-activates the version registered just before the active one. Returns its id."""
+    city = city.upper()
+    with file_lock(INDEX_FILE):
+        versions = [version_id for version_id, _ in list_versions(city)]
+        index = load_index()
+        position = versions.index(index[city]["active"])
+        if position == 0:
+            raise ValueError(f"No earlier {city} model to roll back to.")
+        _set_active(index, city, versions[position - 1])
+    return versions[position - 1]
+
+
+class ModelCache:
+    """
+    LRU cache of deserialized models for a long-running serving process.
+
+    Models (and the encoding tables stored with them) are loaded from the registry
+    on first use, and the cache evicts the least recently used models once their
+    combined size exceeds max_bytes.
+    Cached entries are keyed by (city, version), so rolling back to a version
+    that is still hot takes effect on the next call without touching disk.
+    """
+
+    def __init__(self, max_bytes: int = cfg.MODEL_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._models = OrderedDict()  # (city, version_id) -> (model, encodings, info, size_bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._index = {}
+        self._index_mtime = None
+
+    def _refresh_index(self):
+        # Re-read the index only when it changed on disk (new version, rollback, ...)
+        mtime = INDEX_FILE.stat().st_mtime_ns if INDEX_FILE.exists() else None
+        if mtime != self._index_mtime:
+            self._index = load_index()
+            self._index_mtime = mtime
+
+    def _version_info(self, city: str, version_id: str = None) -> tuple:
+        entry = self._index.get(city)
+        if entry is None:
+            raise KeyError(f"No registered models for {city}")
+        version_id = version_id or entry["active"]
+        if version_id not in entry["versions"]:
+            raise KeyError(f"Unknown model version for {city}: {version_id}")
+        return version_id, entry["versions"][version_id]
+
+    def load(self, city: str, version_id: str = None) -> tuple:
+        """
+        Returns (model, encodings, registry info) of the requested (default: active)
+        version in one lookup, so the three always belong to the same version even
+        if the active version changes concurrently.
+        """
+        city = city.upper()
+        with self._lock:
+            self._refresh_index()
+            version_id, info = self._version_info(city, version_id)
+            key = (city, version_id)
+
+            if key in self._models:
+                # A version re-registered since it was cached (same id, new files) is reloaded
+                if self._models[key][2]["registered_at"] == info["registered_at"]:
+                    self._models.move_to_end(key)
+                    return self._models[key][:3]
+                self._bytes -= self._models.pop(key)[3]
+
+            model, size = _load_model(REGISTRY_DIR / info["model_file"])
+            encodings = _load_encodings(info)
+
+            self._models[key] = (model, encodings, info, size)
+            self._bytes += size
+            # Evict cold models, but always keep the one just requested
+            while self._bytes > self.max_bytes and len(self._models) > 1:
+                _, (*_, evicted_size) = self._models.popitem(last=False)
+                self._bytes -= evicted_size
+            return model, encodings, info
+
+    def get(self, city: str, version_id: str = None):
+        """Returns the requested (default: active) model for a city."""
+        return self.load(city, version_id)[0]
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+
+def _load_model(model_file: Path):
+    from catboost import CatBoostRegressor
+
+    # CatBoost deserializes into its own memory, so the file size is a fair
+    # estimate of the model's footprint for the cache budget
+    model = CatBoostRegressor()
+    model.load_model(str(model_file))
+    return model, model_file.stat().st_size
+
+
+def _load_encodings(info: dict) -> dict:
+    encoding_files = info.get("encoding_files", {})
+    if not encoding_files:
+        return {}
+    import polars as pl
+
+    return {name: pl.read_parquet(REGISTRY_DIR / encoding_file) for name, encoding_file in encoding_files.items()}
+
+
+def print_registry():
+    index = load_index()
+    if not index:
+        print(f"Registry is empty ({INDEX_FILE}). Train a model first.")
+    for city, entry in index.items():
+        print(f"\n{city} (active: {entry['active']})")
+        for version_id, info in list_versions(city):
+            marker = "*" if version_id == entry["active"] else " "
+            print(f" {marker} {version_id}  {info['registered_at']}  R2={info['metrics']['r2']:.4f}")
+
+
+if __name__ == "__main__":
+    print_registry()
@@ -0,0 +1,213 @@
+import os
+import sys
+import shutil
+import multiprocessing
+import polars as pl
+import config as cfg
+import profiling
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from merge_data import (
+    build_merge_query, canonicalize_addresses, collect_raw_addresses,
+    update_address_dictionary, price_raw_address, epc_raw_address
+)
+from feature_engineering import build_feature_query, fit_encoding_stats, combine_encoding_stats, encode_with_stats
+
+sys.path.append(str(Path(__file__).parent))
+
+PRICE_INPUT = cfg.RAW_PRICE_FILE
+EPC_INPUT = cfg.RAW_EPC_FILE
+MERGED_OUTPUT = cfg.MERGED_FILE
+MODEL_READY_OUTPUT = cfg.MODEL_READY_FILE
+
+STAGING_DIR = cfg.DATA_DIR / f"partitions_{cfg.CITY_SLUG}"
+
+# EXECUTOR SETTINGS
+N_WORKERS = os.cpu_count()
+WORKER_MEMORY_GB = 4  # Hard per-worker memory cap (0 disables it)
+
+
+def postcode_area(col_name: str) -> pl.Expr:
+    """Leading letters of a postcode, e.g. 'SW' from 'SW1A 1AA' or 'LS' from 'LS6 2AB'."""
+    return pl.col(col_name).str.to_uppercase().str.extract(r"^([A-Z]{1,2})", 1).alias("postcode_area")
+
+
+def split_by_postcode_area(q: pl.LazyFrame, postcode_col: str, target_dir: Path) -> dict:
+    """
+    Writes one parquet file per postcode area. Because both join keys start with
+    the postcode, a Price row and its matching EPC row always share an area,
+    so each area can be merged independently.
+
+    Every pass streams, so the parent never holds the full input in memory:
+    one pass resolves addresses, tags rows with their area and sorts by it
+    (spilling to disk if needed). Because the staged file is sorted, its
+    row-group statistics let each per-area scan read only that area's row
+    groups, so the whole split reads the staged data about once, not once per area.
+    Returns {area: file size in bytes}.
+    """
+    target_dir.mkdir(parents=True, exist_ok=True)
+    staged_file = target_dir / "_staged.parquet"
+
+    (
+        q
+        .with_columns(postcode_area(postcode_col))
+        .filter(pl.col("postcode_area").is_not_null())
+        .sort("postcode_area")
+        .sink_parquet(staged_file, statistics=True)
+    )
+    areas = profiling.collect(
+        pl.scan_parquet(staged_file).select(pl.col("postcode_area").unique()),
+        f"areas_{target_dir.name}"
+    )["postcode_area"]
+
+    sizes = {}
+    for area in areas:
+        path = target_dir / f"{area}.parquet"
+        (
+            pl.scan_parquet(staged_file)
+            .filter(pl.col("postcode_area") == area)
+            .drop("postcode_area")
+            .sink_parquet(path)
+        )
+        sizes[area] = path.stat().st_size
+    staged_file.unlink()
+    return sizes
+
+
+def _init_worker(memory_bytes: int):
+    # RLIMIT_DATA caps heap and anonymous mappings, which is where Polars allocates.
+    # A worker that exceeds it fails with MemoryError instead of pushing the host into swap.
+    if memory_bytes <= 0:
+        return
+    try:
+        import resource
+    except ImportError:  # Not available on Windows
+        return
+    resource.setrlimit(resource.RLIMIT_DATA, (memory_bytes, memory_bytes))
+
+
+def process_partition(area: str) -> tuple:
+    """Merge + feature engineering for a single postcode area."""
+    price_part = STAGING_DIR / "price" / f"{area}.parquet"
+    epc_part = STAGING_DIR / "epc" / f"{area}.parquet"
+
+    if not epc_part.exists():
+        return area, 0, 0
+
+    merged = build_merge_query(pl.scan_parquet(price_part), pl.scan_parquet(epc_part)).collect()
+    if merged.height == 0:
+        return area, 0, 0
+    merged.write_parquet(STAGING_DIR / "merged" / f"{area}.parquet")
+
+    features = build_feature_query(merged.lazy()).collect()
+    features.write_parquet(STAGING_DIR / "model_ready" / f"{area}.parquet")
+
+    return area, merged.height, features.height
+
+
+@profiling.profiled("merge_features_parallel")
+def run_partitioned_pipeline():
+    """
+    Runs merge + feature engineering per postcode area in a process pool.
+
+    1. Split: Price and EPC inputs are resolved to canonical addresses and
+       partitioned by postcode area.
+    2. Execute: Each area is merged and feature-engineered in its own worker,
+       with Polars threads and memory capped per worker.
+    3. Concatenate: Partitions are target-encoded from city-wide key-level sums,
+       then streamed into the usual merged and model-ready files, so downstream
+       stages are unchanged. The parent holds at most one partition at a time.
+    """
+    print("STARTING PARTITIONED MERGE + FEATURE PIPELINE...")
+
+    if not PRICE_INPUT.exists() or not EPC_INPUT.exists():
+        print(f"Required files not found.\nPrice: {PRICE_INPUT}\nEPC: {EPC_INPUT}")
+        return
+
+    user_threads = os.environ.get("POLARS_MAX_THREADS")
+    shutil.rmtree(STAGING_DIR, ignore_errors=True)
+    for sub_dir in ["merged", "model_ready"]:
+        (STAGING_DIR / sub_dir).mkdir(parents=True)
+
+    try:
+        q_price = pl.scan_parquet(PRICE_INPUT)
+        q_epc = pl.scan_parquet(EPC_INPUT)
+
+        # 1. SPLIT
+        # Addresses are resolved against the canonical-address dictionary once, up front,
+        # so workers never need the (potentially national) dictionary themselves.
+        print("Updating canonical-address dictionary...")
+        address_dictionary = update_address_dictionary(collect_raw_addresses(q_price, q_epc))
+
+        print("Partitioning inputs by postcode area...")
+        price_sizes = split_by_postcode_area(
+            q_price.with_columns(price_raw_address())
+            .pipe(canonicalize_addresses, "full_address_raw", "clean_addr_price", address_dictionary),
+            "postcode", STAGING_DIR / "price"
+        )
+        split_by_postcode_area(
+            q_epc.with_columns(epc_raw_address())
+            .pipe(canonicalize_addresses, "raw_addr", "clean_addr_epc", address_dictionary),
+            "POSTCODE", STAGING_DIR / "epc"
+        )
+
+        # Largest areas first so the pool is not left waiting on one big straggler
+        areas = sorted(price_sizes, key=price_sizes.get, reverse=True)
+        n_workers = min(N_WORKERS, len(areas))
+        threads_per_worker = max(1, os.cpu_count() // n_workers)
+        print(f"{len(areas)} postcode areas | {n_workers} workers x {threads_per_worker} Polars threads "
+              f"| memory cap: {WORKER_MEMORY_GB or 'none'} GB per worker")
+
+        # 2. EXECUTE
+        # Spawned workers read POLARS_MAX_THREADS from the inherited environment when they import Polars
+        os.environ["POLARS_MAX_THREADS"] = str(threads_per_worker)
+        total_merged = total_features = 0
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(int(WORKER_MEMORY_GB * 1024 ** 3),)
+        ) as pool:
+            futures = {pool.submit(process_partition, area): area for area in areas}
+            for future in as_completed(futures):
+                area, n_merged, n_features = future.result()
+                total_merged += n_merged
+                total_features += n_features
+                print(f"  {area:<3} merged: {n_merged:>9,} | model-ready: {n_features:>9,}")
+
+        # 3. CONCATENATE
+        if total_merged == 0:
+            print("CRITICAL: Zero matches found. Check address normalization logic.")
+            return
+
+        pl.scan_parquet(STAGING_DIR / "merged" / "*.parquet").sink_parquet(MERGED_OUTPUT)
+
+        # Target encodings need city-wide statistics. Only the small key x fold sums are
+        # gathered from every partition; each partition is then encoded on its own.
+        model_ready_parts = sorted((STAGING_DIR / "model_ready").glob("*.parquet"))
+        encoding_stats = combine_encoding_stats(
+            [fit_encoding_stats(pl.scan_parquet(part)) for part in model_ready_parts]
+        )
+        for part in model_ready_parts:
+            encoded, _ = encode_with_stats(pl.read_parquet(part), encoding_stats)
+            encoded.write_parquet(part)
+        pl.scan_parquet(STAGING_DIR / "model_ready" / "*.parquet").sink_parquet(MODEL_READY_OUTPUT)
+
+        print(f"MERGE COMPLETE. Final Dataset Rows: {total_merged:,} -> {MERGED_OUTPUT}")
+        print(f"FEATURES COMPLETE. Final Dataset Size: {total_features:,} rows -> {MODEL_READY_OUTPUT}")
+
+    except (MemoryError, BrokenProcessPool):
+        print(f"A partition exceeded the {WORKER_MEMORY_GB} GB worker cap. Raise WORKER_MEMORY_GB or reduce N_WORKERS.")
+    except Exception as e:
+        print(f"Error during partitioned pipeline: {e}")
+    finally:
+        if user_threads is None:
+            os.environ.pop("POLARS_MAX_THREADS", None)
+        else:
+            os.environ["POLARS_MAX_THREADS"] = user_threads
+        shutil.rmtree(STAGING_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    run_partitioned_pipeline()
@@ -1,6 +1,7 @@
 import polars as pl
 import sys
 import config as cfg
+import profiling
 from pathlib import Path
 
 # CONFIGURATION
@@ -16,6 +17,7 @@ OUTPUT_EPC = cfg.RAW_EPC_FILE
 TARGET_CITY = cfg.CURRENT_CITY
 
 
+@profiling.profiled("prepare_city")
 def filter_comparison_city():
     """
     Extracts transaction and EPC data for a specific control city (e.g., Leeds)
@@ -48,7 +50,7 @@ def filter_comparison_city():
             .filter(pl.col("date").dt.year() >= 2018)
         )
 
-        df_price = q_price.collect()
+        df_price = profiling.collect(q_price, "price_paid_scan")
 
         if df_price.height == 0:
             print(f"No price records found for {TARGET_CITY}. Check spelling.")
@@ -74,7 +76,7 @@ def filter_comparison_city():
             .filter(pl.col("POSTTOWN").str.to_uppercase() == TARGET_CITY)
         )
 
-        df_epc = q_epc.collect()
+        df_epc = profiling.collect(q_epc, "epc_scan")
 
         if df_epc.height == 0:
             print(f"No EPC records found for {TARGET_CITY}. Check column names (e.g. POSTTOWN).")
@@ -0,0 +1,203 @@
+"""
+Opt-in profiling for pipeline stages.
+
+Enable with `python src/ecovaluate.py --profile <command>` or by setting
+ECOVALUATE_PROFILE=1 when running a stage script directly. Each profiled stage
+writes a run directory under profiles/ containing:
+
+- cpu.folded: sampled Python stacks in collapsed format, ready for
+  flamegraph.pl, inferno or speedscope.
+- memory_top.txt: top allocation sites from tracemalloc.
+- NN_<query>.plan.txt / NN_<query>.profile.csv: Polars optimized plan and
+  per-node timings for every query collected through profiling.collect().
+- summary.json: wall time, peak traced memory, sample count and git revision.
+
+Only the stage's own process is profiled. Work done in process-pool workers
+(merge-features-parallel, hpi, backtest, compare) is not sampled or traced;
+it shows up as the parent waiting on the pool.
+
+Compare two runs with: python src/profiling.py diff <run_dir_a> <run_dir_b>
+"""
+import os
+import sys
+import json
+import time
+import functools
+import threading
+import subprocess
+import tracemalloc
+import config as cfg
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+PROFILE_ENV = "ECOVALUATE_PROFILE"
+PROFILE_DIR = cfg.PROFILE_DIR
+
+SAMPLE_INTERVAL_S = 0.005  # 200 Hz stack sampling
+TRACEMALLOC_FRAMES = 1  # Report is per line; deeper tracebacks multiply tracemalloc overhead
+TOP_ALLOCATIONS = 25
+
+# Run directory of the stage currently being profiled (None when profiling is off)
+_run_dir = None
+_query_counter = 0
+
+
+def profiling_enabled() -> bool:
+    return os.environ.get(PROFILE_ENV, "").lower() in ("1", "true", "yes")
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples one thread's Python stack at a fixed interval from a daemon thread.
+
+    Time spent inside Polars/CatBoost native code shows up under the Python
+    frame that called it (e.g. LazyFrame.collect), which is the level at which
+    the stages can be tuned.
+    """
+
+    def __init__(self, target_thread_id: int, interval: float = SAMPLE_INTERVAL_S):
+        super().__init__(daemon=True)
+        self.target_thread_id = target_thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target_thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{Path(code.co_filename).name}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def write_folded(self, path: Path):
+        lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        path.write_text("\n".join(lines) + "\n")
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=cfg.ROOT_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def profiled(stage_name: str):
+    """Decorator for stage entry points. A no-op unless profiling is enabled."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            global _run_dir, _query_counter
+            # A profiled stage called from inside another one is recorded in the outer run.
+            # Entry points run one after another (e.g. filter-london) each get their own run.
+            if not profiling_enabled() or _run_dir is not None:
+                return func(*args, **kwargs)
+
+            run_dir = PROFILE_DIR / f"{datetime.now():%Y%m%d_%H%M%S}_{cfg.CITY_SLUG}_{stage_name}"
+            run_dir.mkdir(parents=True, exist_ok=True)
+            _run_dir, _query_counter = run_dir, 0
+            print(f"[PROFILE] Recording {stage_name} to {run_dir}")
+
+            sampler = StackSampler(threading.get_ident())
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            sampler.start()
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                wall_seconds = time.perf_counter() - t0
+                sampler.stop()
+                snapshot = tracemalloc.take_snapshot()
+                _, peak_bytes = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                _run_dir = None
+
+                sampler.write_folded(run_dir / "cpu.folded")
+                _write_memory_report(snapshot, run_dir / "memory_top.txt")
+                (run_dir / "summary.json").write_text(json.dumps({
+                    "stage": stage_name,
+                    "city": cfg.CURRENT_CITY,
+                    "git_revision": _git_revision(),
+                    "wall_seconds": round(wall_seconds, 3),
+                    "peak_traced_mb": round(peak_bytes / 1024 ** 2, 1),
+                    "cpu_samples": sum(sampler.stacks.values()),
+                    "sample_interval_s": SAMPLE_INTERVAL_S,
+                    "polars_queries": _query_counter
+                }, indent=2))
+                print(f"[PROFILE] {stage_name}: {wall_seconds:.1f}s wall, "
+                      f"{peak_bytes / 1024 ** 2:,.0f} MB peak traced memory")
+        return wrapper
+    return decorator
+
+
+def _write_memory_report(snapshot: tracemalloc.Snapshot, path: Path):
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")
+    ])
+    lines = [f"Top {TOP_ALLOCATIONS} allocation sites (Python heap only; native Polars/CatBoost memory is not traced)", ""]
+    for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+        lines.append(f"{stat.size / 1024 ** 2:10.1f} MB  {stat.count:>9,} blocks  {stat.traceback[0]}")
+    path.write_text("\n".join(lines) + "\n")
+
+
+def collect(q, query_name: str):
+    """
+    Collects a Polars LazyFrame. While a stage is being profiled, the optimized
+    plan and per-node timings are saved alongside the other artifacts; the
+    query still runs exactly once.
+    """
+    global _query_counter
+    if _run_dir is None:
+        return q.collect()
+
+    _query_counter += 1
+    prefix = _run_dir / f"{_query_counter:02d}_{query_name}"
+    prefix.with_suffix(".plan.txt").write_text(q.explain())
+
+    df, timings = q.profile()
+    timings.write_csv(prefix.with_suffix(".profile.csv"))
+    return df
+
+
+def _inclusive_shares(run_dir: Path) -> dict:
+    """Share of samples in which each function appears anywhere on the stack."""
+    counts, total = Counter(), 0
+    for line in (Path(run_dir) / "cpu.folded").read_text().splitlines():
+        stack, count = line.rsplit(" ", 1)
+        total += int(count)
+        for frame in set(stack.split(";")):
+            counts[frame] += int(count)
+    return {frame: count / total for frame, count in counts.items()} if total else {}
+
+
+def diff_profiles(run_a: Path, run_b: Path, top: int = 25):
+    """Prints the functions whose share of CPU samples changed most between two runs."""
+    shares_a, shares_b = _inclusive_shares(run_a), _inclusive_shares(run_b)
+    frames = set(shares_a) | set(shares_b)
+    deltas = sorted(frames, key=lambda f: abs(shares_b.get(f, 0) - shares_a.get(f, 0)), reverse=True)
+
+    print(f"{'function':<60} {'A':>7} {'B':>7} {'delta':>7}")
+    for frame in deltas[:top]:
+        a, b = shares_a.get(frame, 0), shares_b.get(frame, 0)
+        print(f"{frame[:60]:<60} {a:7.1%} {b:7.1%} {b - a:+7.1%}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "diff":
+        diff_profiles(Path(sys.argv[2]), Path(sys.argv[3]))
+    else:
+        print("Usage: python src/profiling.py diff <run_dir_a> <run_dir_b>")
@@ -0,0 +1,161 @@
+import sys
+import numpy as np
+import polars as pl
+import config as cfg
+import profiling
+from scipy.spatial import cKDTree
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+INPUT_FILE = cfg.MODEL_READY_FILE
+LOOKUP_FILE = cfg.POSTCODE_LOOKUP_FILE
+OUTPUT_FILE = cfg.SPATIAL_FEATURES_FILE
+
+# Neighbourhood definition
+K_NEIGHBOURS = 10  # Number of comparable sales per transaction
+LOOKBACK_MONTHS = 24  # Only sales from the last 2 years count as 'recent'
+EFFICIENT_RANK = 5  # Ratings A-C (rank >= 5) count as energy efficient
+
+EARTH_RADIUS_M = 6_371_000
+
+
+def project_to_metres(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """
+    Equirectangular projection around the mean latitude of the dataset.
+    At city scale the distortion is negligible, and it lets the KD-tree work
+    with plain Euclidean distances in metres.
+    """
+    lat_rad = np.radians(lat)
+    lon_rad = np.radians(lon)
+    x = EARTH_RADIUS_M * lon_rad * np.cos(lat_rad.mean())
+    y = EARTH_RADIUS_M * lat_rad
+    return np.column_stack([x, y])
+
+
+def compute_neighbour_features(
+    coords: np.ndarray,
+    months: np.ndarray,
+    price_per_sqm: np.ndarray,
+    energy_rank: np.ndarray,
+) -> dict:
+    """
+    Computes leakage-safe comparable-sales features for rows sorted by date.
+
+    Sales are processed one calendar month at a time. For each month, a KD-tree
+    is built over the sales of the preceding LOOKBACK_MONTHS (strictly before the
+    month starts), and the whole month is queried in a single batch using all
+    CPU cores. A sale therefore never sees itself, same-month sales, or anything
+    after it. Months with fewer than K_NEIGHBOURS earlier sales keep NaN features,
+    so every value is always taken over exactly K_NEIGHBOURS comparables.
+    """
+    n = len(coords)
+    median_ppsqm = np.full(n, np.nan)
+    kth_distance = np.full(n, np.nan)
+    share_efficient = np.full(n, np.nan)
+    mean_rank = np.full(n, np.nan)
+
+    for month in np.unique(months):
+        q_lo = np.searchsorted(months, month, side="left")
+        q_hi = np.searchsorted(months, month, side="right")
+        h_lo = np.searchsorted(months, month - np.timedelta64(LOOKBACK_MONTHS, "M"), side="left")
+        h_hi = q_lo
+
+        # Too little history for a full set of comps (e.g. the first months of the data)
+        if h_hi - h_lo < K_NEIGHBOURS:
+            continue
+
+        # Build the index over the historical window and query the month in one batch
+        tree = cKDTree(coords[h_lo:h_hi])
+        dist, idx = tree.query(coords[q_lo:q_hi], k=K_NEIGHBOURS, workers=-1)
+        dist = dist.reshape(q_hi - q_lo, K_NEIGHBOURS)
+        idx = idx.reshape(q_hi - q_lo, K_NEIGHBOURS) + h_lo
+
+        # Gather neighbour attributes as (n_query, k) matrices
+        nb_ppsqm = price_per_sqm[idx]
+        nb_rank = energy_rank[idx]
+
+        median_ppsqm[q_lo:q_hi] = np.median(nb_ppsqm, axis=1)
+        kth_distance[q_lo:q_hi] = dist[:, -1]
+        share_efficient[q_lo:q_hi] = (nb_rank >= EFFICIENT_RANK).mean(axis=1)
+        mean_rank[q_lo:q_hi] = nb_rank.mean(axis=1)
+
+    return {
+        "comps_median_price_per_sqm": median_ppsqm,
+        "comps_kth_distance_m": kth_distance,
+        "comps_share_efficient": share_efficient,
+        "comps_mean_energy_rank": mean_rank,
+    }
+
+
+@profiling.profiled("spatial")
+def build_spatial_features():
+    """
+    Adds k-nearest comparable-sales features to the model-ready dataset.
+    1. Geocoding: Joins each sale to its postcode centroid (lat/long).
+    2. Spatial Index: Builds a KD-tree over earlier sales, month by month.
+    3. Neighbour Features: Median price/sqm, distance to the k-th neighbour
+       and the EPC mix of the k nearest recent sales.
+    """
+    print("Starting spatial feature pipeline...")
+
+    if not INPUT_FILE.exists():
+        print(f"CRITICAL ERROR: {INPUT_FILE} not found. Please run feature engineering first.")
+        return
+
+    if not LOOKUP_FILE.exists():
+        print(f"CRITICAL ERROR: {LOOKUP_FILE} not found. A postcode -> lat/long lookup is required.")
+        return
+
+    try:
+        df = pl.read_parquet(INPUT_FILE).with_row_index("row_id")
+
+        lookup = (
+            pl.read_parquet(LOOKUP_FILE, columns=["postcode", "lat", "long"])
+            .with_columns(pl.col("postcode").str.replace_all(" ", "").alias("join_pcode"))
+            .select(["join_pcode", "lat", "long"])
+            .unique(subset=["join_pcode"], keep="first")
+        )
+
+        # 1. GEOCODING
+        located = (
+            df.select(["row_id", "postcode", "date", "price_per_sqm", "energy_rating_rank"])
+            .with_columns(pl.col("postcode").str.replace_all(" ", "").alias("join_pcode"))
+            .join(lookup, on="join_pcode", how="inner")
+            .filter(pl.col("lat").is_not_null() & pl.col("long").is_not_null())
+            .sort("date")
+        )
+        print(f"Geocoded {located.height:,} of {df.height:,} transactions.")
+
+        # 2. NEIGHBOUR FEATURES
+        coords = project_to_metres(located["lat"].to_numpy(), located["long"].to_numpy())
+        months = located["date"].to_numpy().astype("datetime64[M]")
+
+        print(f"Querying {K_NEIGHBOURS} nearest earlier sales (lookback: {LOOKBACK_MONTHS} months)...")
+        features = compute_neighbour_features(
+            coords,
+            months,
+            located["price_per_sqm"].to_numpy().astype(np.float64),
+            located["energy_rating_rank"].to_numpy().astype(np.float64),
+        )
+
+        df_features = pl.DataFrame({"row_id": located["row_id"], **features}).with_columns(
+            [pl.col(name).fill_nan(None) for name in features]
+        )
+
+        # Transactions without coordinates or a full K_NEIGHBOURS of history keep null features
+        df_final = df.join(df_features, on="row_id", how="left").drop("row_id")
+
+        # 3. REPORTING
+        print("Spatial feature engineering complete.")
+        print(df_final.select(list(features.keys())).describe())
+
+        df_final.write_parquet(OUTPUT_FILE)
+        print(f"\nSpatial Features Saved to: {OUTPUT_FILE}")
+
+    except Exception as e:
+        print(f"Error during spatial feature engineering: {e}")
+
+
+if __name__ == "__main__":
+    build_spatial_features()
@@ -2,10 +2,10 @@ import sys
 import polars as pl
 import numpy as np
 import config as cfg
-from catboost import CatBoostRegressor
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import r2_score, mean_absolute_error, mean_squared_error
+import profiling
 from pathlib import Path
+from model_registry import register_model
+from feature_engineering import ENCODED_COLS, compute_target_encodings, apply_target_encodings
 
 sys.path.append(str(Path(__file__).parent))
 
@@ -13,21 +13,48 @@ INPUT_FILE = cfg.MODEL_READY_FILE
 MODEL_PATH = cfg.MODEL_PATH
 MODEL_DIR = cfg.MODEL_DIR
 
-def train_price_model():
-    print("Starting model training pipeline...")
-
-    # Load Data
-    if not INPUT_FILE.exists():
-        print(f" Input file not found: {INPUT_FILE}")
-        return
-
-    print(f"[INFO] Loading dataset from {INPUT_FILE}...")
-    df = pl.read_parquet(INPUT_FILE)
-
-    # Define Features (X) and Target (y)
-    # Target: Price of the property
-    y = df["price"].to_numpy()
-
+# Selected features for the valuation model
+FEATURE_COLS = [
+    "TOTAL_FLOOR_AREA",
+    "energy_rating_rank",
+    "transaction_year",
+    "property_type",
+    "old_new",
+    "town",
+    "postcode_district"
+]
+
+# Bump whenever FEATURE_COLS or prepare_features change, so registry entries stay comparable
+FEATURE_SPEC_VERSION = 1
+
+# With target encoding, the raw district string is replaced by its numeric encodings
+if cfg.USE_TARGET_ENCODING:
+    FEATURE_COLS = [col for col in FEATURE_COLS if col != "postcode_district"] + ENCODED_COLS
+    # 2 fitted the encodings before the train/test split; 3 left unseen keys null
+    FEATURE_SPEC_VERSION = 4
+
+# CatBoost hyperparameters (shared with the backtest harness)
+MODEL_PARAMS = dict(
+    iterations=1000,  # Total number of trees
+    learning_rate=0.1,  # Step size shrinkage used in update to prevents overfitting
+    depth=8,  # Depth of the tree (6-10 is standard)
+    loss_function='RMSE',  # Root Mean Squared Error optimization
+    eval_metric='R2',  # We track R2 score during training
+    random_seed=42,
+    allow_writing_files=False
+)
+
+
+def prepare_features(df: pl.DataFrame, feature_cols: list = None):
+    """
+    Builds the model feature matrix and the CatBoost categorical indices.
+    Shared by training and backtesting so both see the exact same feature space.
+    feature_cols defaults to FEATURE_COLS (see prepare_registered_features).
+
+    With target encoding enabled, df must already carry the encoded columns:
+    compute_target_encodings() on the training split for training, or
+    apply_target_encodings() with the training lookups when scoring.
+    """
     # Feature Engineering on the fly: Extract Postcode District (e.g., 'SW1A' from 'SW1A 1AA')
     # This helps the model generalize better than using the full unique postcode.
     # We take the part before the space.
@@ -35,46 +62,80 @@ def train_price_model():
         pl.col("postcode").str.split(" ").list.first().alias("postcode_district")
     )
 
-    # Selected features for the valuation model
-    feature_cols = [
-        "TOTAL_FLOOR_AREA",
-        "energy_rating_rank",
-        "transaction_year",
-        "property_type",
-        "old_new",
-        "town",
-        "postcode_district"
-    ]
-
     # Convert to pandas/numpy for Scikit-Learn/CatBoost compatibility
-    X = df.select(feature_cols).to_pandas()
+    X = df.select(feature_cols or FEATURE_COLS).to_pandas()
 
     # Identify Categorical Features for CatBoost
     # CatBoost requires specific indices for categorical columns (text data)
     cat_features_indices = np.where(X.dtypes == object)[0]
 
-    print(f"Features Selected: {feature_cols}")
-    print(f"Categorical Feature Indices: {cat_features_indices}")
+    return X, cat_features_indices
+
+
+def prepare_registered_features(df: pl.DataFrame, info: dict, lookups: dict):
+    """
+    Feature matrix for a registered model, built from its own registry entry
+    (features + stored encodings) rather than the current config, so any
+    version stays usable after a rollback across feature specs.
+    """
+    if set(ENCODED_COLS) & set(info["features"]):
+        if not lookups:
+            raise KeyError("Model version has no stored target encodings. Retrain it.")
+        df = apply_target_encodings(df, lookups)
+    return prepare_features(df, info["features"])
+
+
+@profiling.profiled("train")
+def train_price_model():
+    # CatBoost and scikit-learn are imported here rather than at module level:
+    # other stages import this module only for FEATURE_COLS / prepare_features.
+    from catboost import CatBoostRegressor
+    from sklearn.model_selection import train_test_split
+    from sklearn.metrics import r2_score, mean_absolute_error, mean_squared_error
+
+    print("Starting model training pipeline...")
+
+    # Load Data
+    if not INPUT_FILE.exists():
+        print(f" Input file not found: {INPUT_FILE}")
+        return
+
+    print(f"[INFO] Loading dataset from {INPUT_FILE}...")
+    df = pl.read_parquet(INPUT_FILE)
 
     # Train/Test Split
+    # Rows are split before any target encoding, so test prices never reach the training features
     print("Splitting data into Training (80%) and Testing (20%) sets...")
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42, shuffle=True
+    train_idx, test_idx = train_test_split(
+        np.arange(df.height), test_size=0.2, random_state=42, shuffle=True
     )
+    df_train, df_test = df[train_idx], df[test_idx]
+
+    # Encodings are fitted on the training split only; test rows are scored with
+    # the resulting lookup tables, exactly as at inference time
+    lookups = None
+    if cfg.USE_TARGET_ENCODING:
+        df_train, lookups = compute_target_encodings(df_train)
+        df_test = apply_target_encodings(df_test, lookups)
+
+    # Define Features (X) and Target (y)
+    # Target: Price of the property
+    X_train, cat_features_indices = prepare_features(df_train)
+    X_test, _ = prepare_features(df_test)
+    y_train = df_train["price"].to_numpy()
+    y_test = df_test["price"].to_numpy()
+    feature_cols = FEATURE_COLS
+
+    print(f"Features Selected: {feature_cols}")
+    print(f"Categorical Feature Indices: {cat_features_indices}")
 
     # 4. Initialize and Train CatBoost Regressor
     print("Initializing CatBoost Regressor...")
     print("Training started. This may take a few minutes...")
 
     model = CatBoostRegressor(
-        iterations=1000,  # Total number of trees
-        learning_rate=0.1,  # Step size shrinkage used in update to prevents overfitting
-        depth=8,  # Depth of the tree (6-10 is standard)
-        loss_function='RMSE',  # Root Mean Squared Error optimization
-        eval_metric='R2',  # We track R2 score during training
-        random_seed=42,
-        verbose=100,  # Log progress every 100 iterations
-        allow_writing_files=False
+        **MODEL_PARAMS,
+        verbose=100  # Log progress every 100 iterations
     )
 
     # Fit the model
@@ -104,6 +165,21 @@ def train_price_model():
     model.save_model(str(MODEL_PATH))
     print(f"Model saved successfully to: {MODEL_PATH}")
 
+    # Record the model, its data fingerprint, metrics and encoding lookups in the registry
+    metrics = {
+        "r2": float(r2),
+        "mae": float(mae),
+        "rmse": float(rmse),
+        "best_iteration": model.get_best_iteration(),
+        "n_train": len(X_train),
+        "n_test": len(X_test)
+    }
+    version_id = register_model(
+        MODEL_PATH, cfg.CURRENT_CITY, INPUT_FILE, FEATURE_SPEC_VERSION, feature_cols, metrics,
+        encodings=lookups
+    )
+    print(f"Registered as {cfg.CURRENT_CITY} model version: {version_id}")
+
     # 7. Feature Importance Analysis
     print("\nTop 3 Most Influential Features:")
     importance = model.get_feature_importance()